@@ -1,10 +1,34 @@
 import pygame
 import random
 import math
+import argparse
+import gc
+import time
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+from array import array
+from collections import deque, namedtuple
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 WIDTH, HEIGHT = 1400, 850
 CELL_SIZE = 10
 FPS = 30
+TICK_RATE = 30
+SPEEDS = (1, 10, 100, None)
+RENDER_EVERY = (1, 2, 5, 10, 30)
+MAX_DIRTY_RECTS = 1500
+GRID_WIDTH, GRID_HEIGHT = WIDTH // CELL_SIZE, HEIGHT // CELL_SIZE
+CHUNK_SIZE = 32
+MAX_ZOOM = 40
 
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
@@ -20,6 +44,9 @@ PURPLE = (128, 0, 128)
 ORANGE = (255, 165, 0)
 DARK_GRAY = (50, 50, 50)
 
+TERRAIN_COLORS = [DARK_GREEN, BLUE, SAND, GRAY]
+WALKABLE_TABLE = bytes([1, 0, 1, 0] + [0] * 252)
+
 
 class GameSettings:
     def __init__(self):
@@ -45,6 +72,13 @@ class GameSettings:
         self.food_spawn_chance = 0.7
         self.disaster_chance = 0.0001
         self.meteor_radius = 3
+        self.fire_spread_chance = 0.35
+        self.fire_burnout_chance = 0.3
+        self.flood_spread_chance = 0.3
+        self.flood_recede_chance = 0.15
+        self.plague_spread_chance = 0.15
+        self.plague_death_chance = 0.02
+        self.plague_duration = 60
         self.human_max_age = 500
         self.elf_max_age = 800
         self.dwarf_max_age = 700
@@ -57,17 +91,21 @@ class GameSettings:
         self.elf_speed = 1.2
         self.dwarf_speed = 1.4
         self.orc_speed = 1.1
+        self.inactive_chunk_interval = 1
+        self.foraging = False
+        self.forage_radius = 12
 
 
 settings = GameSettings()
 
 
 class Slider:
-    def __init__(self, x, y, w, h, min_val, max_val, initial_val, label, step=1):
+    def __init__(self, x, y, w, h, min_val, max_val, setting, label, step=1):
         self.rect = pygame.Rect(x, y, w, h)
         self.min_val = min_val
         self.max_val = max_val
-        self.value = initial_val
+        self.setting = setting
+        self.value = getattr(settings, setting)
         self.label = label
         self.step = step
         self.dragging = False
@@ -94,19 +132,24 @@ class Slider:
             if (abs(mouse_pos[0] - handle_x) < self.handle_radius and abs(
                     mouse_pos[1] - handle_y) < self.handle_radius) or self.rect.collidepoint(mouse_pos):
                 self.dragging = True
-                self.update_value(mouse_pos[0])
+                return self.update_value(mouse_pos[0])
         elif event.type == pygame.MOUSEBUTTONUP:
             self.dragging = False
         elif event.type == pygame.MOUSEMOTION and self.dragging:
-            self.update_value(event.pos[0])
+            return self.update_value(event.pos[0])
+        return False
 
     def update_value(self, mouse_x):
         relative_x = mouse_x - self.rect.x
         relative_x = max(0, min(self.rect.width, relative_x))
         ratio = relative_x / self.rect.width
         new_value = self.min_val + ratio * (self.max_val - self.min_val)
-        self.value = round(new_value / self.step) * self.step
-        self.value = max(self.min_val, min(self.max_val, self.value))
+        new_value = max(self.min_val, min(self.max_val, round(new_value / self.step) * self.step))
+        if new_value == self.value:
+            return False
+        self.value = new_value
+        setattr(settings, self.setting, new_value)
+        return True
 
 
 class Terrain:
@@ -115,61 +158,649 @@ class Terrain:
     SAND = 2
     MOUNTAIN = 3
 
-    def __init__(self):
-        self.grid = [[Terrain.GRASS for _ in range(WIDTH // CELL_SIZE)] for _ in range(HEIGHT // CELL_SIZE)]
-        self.generate_terrain()
+    SEED_STREAM = 1
 
-    def generate_terrain(self):
-        for _ in range(9):
-            x = random.randint(20, WIDTH // CELL_SIZE - 20)
-            y = random.randint(15, HEIGHT // CELL_SIZE - 15)
+    def __init__(self, width=GRID_WIDTH, height=GRID_HEIGHT, generate=True, seed=None):
+        self.width = width
+        self.height = height
+        self.chunks = {}
+        self.walkable = bytearray(b"\x01") * (width * height)
+        self.dirty = []
+        self.watchers = []
+        if generate:
+            self.generate_terrain(seed)
+
+    def generate_terrain(self, seed=None):
+        if np is None:
+            self.scatter_features()
+            return
+        rng = np.random.default_rng(None if seed is None else [seed, Terrain.SEED_STREAM])
+        self.load_grid(generate_grid(self.width, self.height, rng))
+
+    def scatter_features(self):
+        scale = max(1, self.width * self.height // (GRID_WIDTH * GRID_HEIGHT))
+        for _ in range(9 * scale):
+            x = random.randint(20, self.width - 20)
+            y = random.randint(15, self.height - 15)
             size = random.randint(2, 8)
             for dx in range(-size, size):
                 for dy in range(-size, size):
                     if (dx * dx + dy * dy) < size * size:
                         nx, ny = x + dx, y + dy
-                        if 0 <= nx < WIDTH // CELL_SIZE and 0 <= ny < HEIGHT // CELL_SIZE:
-                            self.grid[ny][nx] = Terrain.WATER
-        for _ in range(6):
-            x = random.randint(25, WIDTH // CELL_SIZE - 25)
-            y = random.randint(20, HEIGHT // CELL_SIZE - 20)
+                        if 0 <= nx < self.width and 0 <= ny < self.height:
+                            self.set(nx, ny, Terrain.WATER)
+        for _ in range(6 * scale):
+            x = random.randint(25, self.width - 25)
+            y = random.randint(20, self.height - 20)
             size = random.randint(3, 10)
             for dx in range(-size, size):
                 for dy in range(-size, size):
                     if random.random() > 0.5:
                         nx, ny = x + dx, y + dy
-                        if 0 <= nx < WIDTH // CELL_SIZE and 0 <= ny < HEIGHT // CELL_SIZE:
-                            if self.grid[ny][nx] != Terrain.WATER:
-                                self.grid[ny][nx] = Terrain.SAND
-        for _ in range(15):
-            x = random.randint(15, WIDTH // CELL_SIZE - 15)
-            y = random.randint(15, HEIGHT // CELL_SIZE - 15)
-            if self.grid[y][x] != Terrain.WATER:
-                self.grid[y][x] = Terrain.MOUNTAIN
+                        if 0 <= nx < self.width and 0 <= ny < self.height:
+                            if self.get(nx, ny) != Terrain.WATER:
+                                self.set(nx, ny, Terrain.SAND)
+        for _ in range(15 * scale):
+            x = random.randint(15, self.width - 15)
+            y = random.randint(15, self.height - 15)
+            if self.get(x, y) != Terrain.WATER:
+                self.set(x, y, Terrain.MOUNTAIN)
+
+    def get(self, x, y):
+        chunk = self.chunks.get((x // CHUNK_SIZE, y // CHUNK_SIZE))
+        if chunk is None:
+            return Terrain.GRASS
+        return chunk[y % CHUNK_SIZE * CHUNK_SIZE + x % CHUNK_SIZE]
+
+    def set(self, x, y, terrain_type):
+        key = (x // CHUNK_SIZE, y // CHUNK_SIZE)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            if terrain_type == Terrain.GRASS:
+                return
+            chunk = self.chunks[key] = bytearray(CHUNK_SIZE * CHUNK_SIZE)
+        chunk[y % CHUNK_SIZE * CHUNK_SIZE + x % CHUNK_SIZE] = terrain_type
+        self.walkable[y * self.width + x] = WALKABLE_TABLE[terrain_type]
+
+    def paint(self, xs, ys, terrain_type):
+        if len(xs) == 0:
+            return
+        for x, y in zip(xs, ys):
+            self.set(int(x), int(y), terrain_type)
+        self.mark_dirty(int(min(xs)), int(min(ys)), int(max(xs)) + 1, int(max(ys)) + 1)
+        for watcher in self.watchers:
+            watcher(xs, ys)
+
+    def set_chunk(self, cx, cy, data):
+        chunk = self.chunks[(cx, cy)] = bytearray(data)
+        x0, x1 = cx * CHUNK_SIZE, min(self.width, (cx + 1) * CHUNK_SIZE)
+        for y in range(cy * CHUNK_SIZE, min(self.height, (cy + 1) * CHUNK_SIZE)):
+            row = (y - cy * CHUNK_SIZE) * CHUNK_SIZE
+            self.walkable[y * self.width + x0:y * self.width + x1] = \
+                chunk[row:row + x1 - x0].translate(WALKABLE_TABLE)
+
+    def load_grid(self, grid):
+        self.chunks.clear()
+        self.walkable[:] = ((grid != Terrain.WATER) & (grid != Terrain.MOUNTAIN)).tobytes()
+        rows, columns = -(-self.height // CHUNK_SIZE), -(-self.width // CHUNK_SIZE)
+        padded = np.zeros((rows * CHUNK_SIZE, columns * CHUNK_SIZE), dtype=np.int8)
+        padded[:self.height, :self.width] = grid
+        blocks = padded.reshape(rows, CHUNK_SIZE, columns, CHUNK_SIZE).swapaxes(1, 2)
+        for cy, cx in zip(*np.nonzero(blocks.any(axis=(2, 3)))):
+            self.chunks[(int(cx), int(cy))] = bytearray(blocks[cy, cx].tobytes())
+
+    def region(self, x0, y0, x1, y1):
+        width = x1 - x0
+        cells = bytearray(width * (y1 - y0))
+        for cx, cy in chunk_range(x0, y0, x1, y1):
+            chunk = self.chunks.get((cx, cy))
+            if chunk is None:
+                continue
+            left, right = max(x0, cx * CHUNK_SIZE), min(x1, (cx + 1) * CHUNK_SIZE)
+            for y in range(max(y0, cy * CHUNK_SIZE), min(y1, (cy + 1) * CHUNK_SIZE)):
+                row = (y - cy * CHUNK_SIZE) * CHUNK_SIZE - cx * CHUNK_SIZE
+                out = (y - y0) * width - x0
+                cells[out + left:out + right] = chunk[row + left:row + right]
+        return cells
+
+    def types(self, xs, ys):
+        cells = np.zeros(len(xs), dtype=np.int8)
+        columns = -(-self.width // CHUNK_SIZE)
+        keys = ys // CHUNK_SIZE * columns + xs // CHUNK_SIZE
+        offsets = ys % CHUNK_SIZE * CHUNK_SIZE + xs % CHUNK_SIZE
+        for key in np.unique(keys).tolist():
+            chunk = self.chunks.get((key % columns, key // columns))
+            if chunk is not None:
+                here = keys == key
+                cells[here] = np.frombuffer(chunk, dtype=np.int8)[offsets[here]]
+        return cells
 
     def get_color(self, terrain_type):
-        colors = {Terrain.GRASS: DARK_GREEN, Terrain.WATER: BLUE, Terrain.SAND: SAND, Terrain.MOUNTAIN: GRAY}
-        return colors.get(terrain_type, BLACK)
+        if 0 <= terrain_type < len(TERRAIN_COLORS):
+            return TERRAIN_COLORS[terrain_type]
+        return BLACK
+
+    def mark_dirty(self, x0, y0, x1, y1):
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(self.width, x1), min(self.height, y1)
+        if x0 < x1 and y0 < y1:
+            self.dirty.append((x0, y0, x1, y1))
 
     def is_walkable(self, x, y):
-        if 0 <= x < WIDTH // CELL_SIZE and 0 <= y < HEIGHT // CELL_SIZE:
-            return self.grid[y][x] not in [Terrain.WATER, Terrain.MOUNTAIN]
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.walkable[y * self.width + x] == 1
         return False
 
+    def walkable_array(self):
+        return np.frombuffer(self.walkable, dtype=np.bool_).reshape(self.height, self.width)
+
+
+def value_noise(rng, width, height, scale):
+    coarse = rng.random((height // scale + 2, width // scale + 2), dtype=np.float32)
+    xs = np.arange(width, dtype=np.float32) / scale
+    x0 = xs.astype(np.intp)
+    tx = xs - x0
+    rows = coarse[:, x0] * (1 - tx) + coarse[:, x0 + 1] * tx
+    steps = rows[1:] - rows[:-1]
+    ty = (np.arange(scale, dtype=np.float32) / scale)[:, None]
+    field = np.empty((height, width), dtype=np.float32)
+    for top in range(0, height, scale):
+        band = field[top:top + scale]
+        np.multiply(steps[top // scale], ty[:len(band)], out=band)
+        band += rows[top // scale]
+    return field
+
+
+def sample_quantile(field, q):
+    return np.quantile(field.ravel()[::field.size // 65536 | 1], q)
+
+
+def stamp_disks(grid, xs, ys, radii, value):
+    height, width = grid.shape
+    for radius in np.unique(radii):
+        dy, dx = np.mgrid[-radius:radius, -radius:radius]
+        disk = dx * dx + dy * dy < radius * radius
+        mine = radii == radius
+        px = (xs[mine, None] + dx[disk]).ravel()
+        py = (ys[mine, None] + dy[disk]).ravel()
+        inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+        grid[py[inside], px[inside]] = value
+
+
+def generate_grid(width, height, rng):
+    grid = np.zeros((height, width), dtype=np.int8)
+    scale = max(1, width * height // (GRID_WIDTH * GRID_HEIGHT))
+    lakes = 9 * scale
+    margin_x, margin_y = min(20, width // 4), min(15, height // 4)
+    stamp_disks(grid, rng.integers(margin_x, width - margin_x + 1, lakes),
+                rng.integers(margin_y, height - margin_y + 1, lakes), rng.integers(2, 9, lakes), Terrain.WATER)
+    land = grid != Terrain.WATER
+
+    sand = value_noise(rng, width, height, 16)
+    sand = sand > sample_quantile(sand, 0.92)
+    sand &= np.frombuffer(rng.bytes(width * height), dtype=np.uint8).reshape(height, width) < 128
+    grid[sand & land] = Terrain.SAND
+    del sand
+
+    ridge = value_noise(rng, width, height, 48)
+    ridge -= 0.5
+    np.abs(ridge, out=ridge)
+    ranges = value_noise(rng, width, height, 96)
+    mountains = (ridge < sample_quantile(ridge, 0.03)) & (ranges > sample_quantile(ranges, 0.6))
+    grid[mountains & land] = Terrain.MOUNTAIN
+    return grid
+
+
+def chunk_range(x0, y0, x1, y1):
+    for cy in range(y0 // CHUNK_SIZE, (y1 - 1) // CHUNK_SIZE + 1):
+        for cx in range(x0 // CHUNK_SIZE, (x1 - 1) // CHUNK_SIZE + 1):
+            yield cx, cy
+
+
+class Camera:
+    def __init__(self, world_width, world_height, view_width=WIDTH, view_height=HEIGHT, zoom=CELL_SIZE):
+        self.world_width = world_width
+        self.world_height = world_height
+        self.view_width = view_width
+        self.view_height = view_height
+        self.zoom = zoom
+        self.x = 0
+        self.y = 0
+
+    def state(self):
+        return self.x, self.y, self.zoom
+
+    def clamp(self):
+        self.x = max(0, min(self.x, self.world_width * self.zoom - self.view_width))
+        self.y = max(0, min(self.y, self.world_height * self.zoom - self.view_height))
+
+    def pan(self, dx, dy):
+        self.x += dx
+        self.y += dy
+        self.clamp()
+
+    def zoom_at(self, step, px, py):
+        zoom = max(1, min(MAX_ZOOM, self.zoom + step))
+        cell_x, cell_y = (self.x + px) / self.zoom, (self.y + py) / self.zoom
+        self.zoom = zoom
+        self.x = int(cell_x * zoom - px)
+        self.y = int(cell_y * zoom - py)
+        self.clamp()
+
+    def visible(self):
+        x1 = min(self.world_width, -(-(self.x + self.view_width) // self.zoom))
+        y1 = min(self.world_height, -(-(self.y + self.view_height) // self.zoom))
+        return self.x // self.zoom, self.y // self.zoom, x1, y1
+
+    def to_cell(self, px, py):
+        return (self.x + px) // self.zoom, (self.y + py) // self.zoom
+
+    def to_screen(self, x, y):
+        return x * self.zoom - self.x, y * self.zoom - self.y
+
+    def cell_rect(self, x, y, w=1, h=1):
+        return pygame.Rect(x * self.zoom - self.x, y * self.zoom - self.y, w * self.zoom, h * self.zoom)
+
+
+class TerrainSurface:
+    def __init__(self, terrain):
+        self.terrain = terrain
+        self.max_chunks = 0
+        self.chunks = {}
+        terrain.dirty.clear()
+
+    def chunk(self, cx, cy, zoom):
+        cached = self.chunks.pop((cx, cy), None)
+        if cached is None or cached[0] != zoom:
+            x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+            x1, y1 = min(self.terrain.width, x0 + CHUNK_SIZE), min(self.terrain.height, y0 + CHUNK_SIZE)
+            surface = pygame.Surface(((x1 - x0) * zoom, (y1 - y0) * zoom))
+            surface.fill(self.terrain.get_color(Terrain.GRASS))
+            width = x1 - x0
+            for i, terrain_type in enumerate(self.terrain.region(x0, y0, x1, y1)):
+                if terrain_type != Terrain.GRASS:
+                    surface.fill(self.terrain.get_color(terrain_type), (i % width * zoom, i // width * zoom, zoom, zoom))
+            cached = (zoom, surface)
+            while self.chunks and len(self.chunks) >= self.max_chunks:
+                del self.chunks[next(iter(self.chunks))]
+        self.chunks[(cx, cy)] = cached
+        return cached[1]
+
+    def refresh(self, camera):
+        rects = []
+        for x0, y0, x1, y1 in self.terrain.dirty:
+            for key in chunk_range(x0, y0, x1, y1):
+                self.chunks.pop(key, None)
+            rects.append(camera.cell_rect(x0, y0, x1 - x0, y1 - y0))
+        self.terrain.dirty.clear()
+        return rects
+
+    def draw(self, screen, camera):
+        visible = list(chunk_range(*camera.visible()))
+        self.max_chunks = 2 * len(visible)
+        for cx, cy in visible:
+            screen.blit(self.chunk(cx, cy, camera.zoom), camera.to_screen(cx * CHUNK_SIZE, cy * CHUNK_SIZE))
+
+
+class CellRenderer:
+    def __init__(self, terrain, max_chunks=4096):
+        self.terrain = terrain
+        self.max_chunks = max_chunks
+        self.palette = np.array(TERRAIN_COLORS, dtype=np.uint8)
+        self.chunks = {}
+        self.cells = None
+        self.surface = None
+        terrain.dirty.clear()
+
+    def chunk(self, cx, cy):
+        image = self.chunks.pop((cx, cy), None)
+        if image is None:
+            x0, y0 = cx * CHUNK_SIZE, cy * CHUNK_SIZE
+            x1, y1 = min(self.terrain.width, x0 + CHUNK_SIZE), min(self.terrain.height, y0 + CHUNK_SIZE)
+            cells = np.frombuffer(self.terrain.region(x0, y0, x1, y1), dtype=np.int8).reshape(y1 - y0, x1 - x0)
+            image = self.palette[cells.T]
+            if len(self.chunks) >= self.max_chunks:
+                del self.chunks[next(iter(self.chunks))]
+        self.chunks[(cx, cy)] = image
+        return image
+
+    def refresh(self):
+        for region in self.terrain.dirty:
+            for key in chunk_range(*region):
+                self.chunks.pop(key, None)
+        self.terrain.dirty.clear()
+
+    def draw(self, screen, world, camera):
+        x0, y0, x1, y1 = camera.visible()
+        buffer = np.empty((x1 - x0, y1 - y0, 3), dtype=np.uint8)
+        for cx, cy in chunk_range(x0, y0, x1, y1):
+            image = self.chunk(cx, cy)
+            left, top = max(x0, cx * CHUNK_SIZE), max(y0, cy * CHUNK_SIZE)
+            right, bottom = min(x1, cx * CHUNK_SIZE + image.shape[0]), min(y1, cy * CHUNK_SIZE + image.shape[1])
+            buffer[left - x0:right - x0, top - y0:bottom - y0] = \
+                image[left - cx * CHUNK_SIZE:right - cx * CHUNK_SIZE, top - cy * CHUNK_SIZE:bottom - cy * CHUNK_SIZE]
+        if world.food.cells:
+            cells = np.array(list(world.food.cells), dtype=np.int32)
+            inside = (cells[:, 0] >= x0) & (cells[:, 0] < x1) & (cells[:, 1] >= y0) & (cells[:, 1] < y1)
+            buffer[cells[inside, 0] - x0, cells[inside, 1] - y0] = YELLOW
+        xs, ys, colors = world.agent_cells()
+        if len(xs):
+            inside = (xs >= x0) & (xs < x1) & (ys >= y0) & (ys < y1)
+            buffer[xs[inside] - x0, ys[inside] - y0] = colors[inside]
+        if self.cells is None or self.cells.get_size() != buffer.shape[:2]:
+            self.cells = pygame.Surface(buffer.shape[:2])
+        size = (buffer.shape[0] * camera.zoom, buffer.shape[1] * camera.zoom)
+        if self.surface is None or self.surface.get_size() != size:
+            self.surface = pygame.Surface(size)
+        pygame.surfarray.blit_array(self.cells, buffer)
+        pygame.transform.scale(self.cells, size, self.surface)
+        return screen.blit(self.surface, camera.to_screen(x0, y0))
+
+
+class SpatialHash:
+    def __init__(self, tile_size=5):
+        self.tile_size = tile_size
+        self.buckets = {}
+
+    def key(self, x, y):
+        return x // self.tile_size, y // self.tile_size
+
+    def insert(self, item):
+        key = self.key(item.x, item.y)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = {}
+        bucket[item] = None
+
+    def remove(self, item, x=None, y=None):
+        key = self.key(item.x if x is None else x, item.y if y is None else y)
+        bucket = self.buckets.get(key)
+        if bucket is not None and item in bucket:
+            del bucket[item]
+            if not bucket:
+                del self.buckets[key]
+
+    def __contains__(self, item):
+        return item in self.buckets.get(self.key(item.x, item.y), ())
+
+    def move(self, item, old_x, old_y):
+        if self.key(old_x, old_y) != self.key(item.x, item.y):
+            self.remove(item, old_x, old_y)
+            self.insert(item)
+
+    def query(self, x, y, radius):
+        tx0, ty0 = self.key(x - radius, y - radius)
+        tx1, ty1 = self.key(x + radius, y + radius)
+        found = []
+        for ty in range(ty0, ty1 + 1):
+            for tx in range(tx0, tx1 + 1):
+                bucket = self.buckets.get((tx, ty))
+                if bucket:
+                    found.extend(item for item in bucket if abs(item.x - x) <= radius and abs(item.y - y) <= radius)
+        return found
+
+    def within(self, x0, y0, x1, y1):
+        tx0, ty0 = self.key(x0, y0)
+        tx1, ty1 = self.key(x1, y1)
+        if (tx1 - tx0 + 1) * (ty1 - ty0 + 1) > len(self.buckets):
+            keys = [key for key in self.buckets if tx0 <= key[0] <= tx1 and ty0 <= key[1] <= ty1]
+        else:
+            keys = [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1) if (tx, ty) in self.buckets]
+        return [item for key in keys for item in self.buckets[key] if x0 <= item.x <= x1 and y0 <= item.y <= y1]
+
+    def at(self, x, y):
+        bucket = self.buckets.get(self.key(x, y))
+        if not bucket:
+            return []
+        return [item for item in bucket if item.x == x and item.y == y]
+
+    def colocated(self):
+        groups = []
+        for bucket in self.buckets.values():
+            if len(bucket) < 2:
+                continue
+            cells = {}
+            for item in bucket:
+                cells.setdefault((item.x, item.y), []).append(item)
+            groups.extend(group for group in cells.values() if len(group) > 1)
+        return groups
+
 
 class Food:
+    __slots__ = ("x", "y")
+
     def __init__(self, x, y):
         self.x = x
         self.y = y
 
 
+class FoodStore:
+    def __init__(self):
+        self.cells = {}
+        self.count = 0
+        self.spare = []
+        self.field = None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for bucket in self.cells.values():
+            yield from bucket
+
+    def add(self, x, y):
+        if self.spare:
+            food = self.spare.pop()
+            food.x, food.y = x, y
+        else:
+            food = Food(x, y)
+        bucket = self.cells.get((x, y))
+        if bucket is None:
+            bucket = self.cells[(x, y)] = []
+            if self.field:
+                self.field.add_source(x, y)
+        bucket.append(food)
+        self.count += 1
+
+    def release(self, food):
+        self.spare.append(food)
+
+    def take_near(self, x, y, radius):
+        cells = self.cells
+        for ny in range(y - radius, y + radius + 1):
+            for nx in range(x - radius, x + radius + 1):
+                bucket = cells.get((nx, ny))
+                if bucket:
+                    food = bucket.pop()
+                    if not bucket:
+                        del cells[(nx, ny)]
+                        if self.field:
+                            self.field.remove_source(nx, ny)
+                    self.count -= 1
+                    return food
+        return None
+
+
+class FoodField:
+    UNREACHED = 0xFFFF
+    OFFSETS = ((0, 0), (-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+    BLOCK = 16
+
+    def __init__(self, terrain, food, grid=None, clear=None):
+        self.terrain = terrain
+        self.width, self.height = terrain.width, terrain.height
+        self.reach = max(0, int(settings.food_search_radius))
+        self.horizon = max(self.reach, min(int(settings.forage_radius), FoodField.UNREACHED - 1))
+        if grid is None:
+            grid = np.empty(self.width * self.height, dtype=np.uint16)
+        if clear is None:
+            clear = np.empty(self.width * self.height, dtype=np.bool_)
+        self.grid = grid.reshape(self.height, self.width)
+        self.dist = memoryview(grid)
+        self.clear_grid = clear.reshape(self.height, self.width)
+        self.clear = memoryview(clear)
+        self.opened = []
+        self.sources = np.zeros((self.height, self.width), dtype=np.bool_)
+        for x, y in food.cells:
+            self.sources[y, x] = True
+        self.added = []
+        self.dirty = {}
+        self.rebuild()
+        self.reopen(0, 0, self.width, self.height)
+        terrain.watchers.append(self.terrain_changed)
+
+    def detach(self):
+        self.terrain.watchers.remove(self.terrain_changed)
+
+    def array(self):
+        return self.grid
+
+    def step(self, dist, core, walkable):
+        height, width = dist.shape[-2:]
+        best = dist[..., :-2, :-2].copy()
+        for dx, dy in FoodField.OFFSETS[2:]:
+            np.minimum(best, dist[..., 1 + dy:height - 1 + dy, 1 + dx:width - 1 + dx], out=best)
+        step = np.where(walkable & (best < self.horizon), best + 1, FoodField.UNREACHED).astype(np.uint16)
+        return np.minimum(step, core, out=step)
+
+    def rebuild(self):
+        walkable = self.terrain.walkable_array()
+        core = np.where(self.sources & walkable, 0, FoodField.UNREACHED).astype(np.uint16)
+        dist = np.empty((self.height + 2, self.width + 2), dtype=np.uint16)
+        for _ in range(self.horizon):
+            dist[1:-1, 1:-1] = core
+            dist[0], dist[-1] = dist[-2], dist[1]
+            dist[:, 0], dist[:, -1] = dist[:, -2], dist[:, 1]
+            step = self.step(dist, core, walkable)
+            if np.array_equal(step, core):
+                break
+            core = step
+        self.grid[:] = core
+
+    def relax(self, blocks):
+        span = np.arange(-self.horizon - 1, FoodField.BLOCK + self.horizon + 1)
+        rows = (blocks[:, 1:] * FoodField.BLOCK + span) % self.height
+        cols = (blocks[:, :1] * FoodField.BLOCK + span) % self.width
+        index = rows[:, :, None] * self.width + cols[:, None, :]
+        inner = index[:, 1:-1, 1:-1]
+        dist = self.grid.reshape(-1)
+        walkable = self.terrain.walkable_array().reshape(-1)[inner]
+        core = np.where(self.sources.reshape(-1)[inner] & walkable, 0, FoodField.UNREACHED).astype(np.uint16)
+        dist[inner] = core
+        for _ in range(self.horizon):
+            around = dist[index]
+            step = self.step(around, core, walkable)
+            if np.array_equal(step, around[:, 1:-1, 1:-1]):
+                break
+            dist[inner] = step
+
+    def lower(self, cells):
+        dist, width, height = self.grid.reshape(-1), self.width, self.height
+        walkable = self.terrain.walkable_array().reshape(-1)
+        xs, ys = np.array(cells, dtype=np.int64).T
+        frontier = ys * width + xs
+        frontier = frontier[self.sources[ys, xs] & walkable[frontier] & (dist[frontier] > 0)]
+        dist[frontier] = 0
+        offsets = np.array(FoodField.OFFSETS[1:])
+        for d in range(1, self.horizon + 1):
+            if not len(frontier):
+                break
+            x, y = frontier % width, frontier // width
+            around = np.unique((y[:, None] + offsets[:, 1]) % height * width + (x[:, None] + offsets[:, 0]) % width)
+            frontier = around[(dist[around] > d) & walkable[around]]
+            dist[frontier] = d
+
+    def reopen(self, x0, y0, x1, y1):
+        reach, width, height = self.reach, self.width, self.height
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        top, left = max(y0 - reach, 0), max(x0 - reach, 0)
+        bottom, right = min(y1 + reach, height), min(x1 + reach, width)
+        walkable = np.pad(self.terrain.walkable_array()[top:bottom, left:right],
+                          ((reach - y0 + top, reach - bottom + y1), (reach - x0 + left, reach - right + x1)),
+                          constant_values=True)
+        across = walkable[:, :x1 - x0].copy()
+        for d in range(1, 2 * reach + 1):
+            across &= walkable[:, d:d + x1 - x0]
+        clear = across[:y1 - y0].copy()
+        for d in range(1, 2 * reach + 1):
+            clear &= across[d:d + y1 - y0]
+        self.clear_grid[y0:y1, x0:x1] = clear
+
+    def flush(self):
+        if self.added:
+            self.lower(self.added)
+            self.added = []
+        if self.dirty:
+            blocks = np.array(list(self.dirty), dtype=np.int64)
+            self.dirty = {}
+            size = FoodField.BLOCK + 2 * self.horizon + 2
+            if size > min(self.width, self.height) or len(blocks) * size * size >= self.width * self.height:
+                self.rebuild()
+            else:
+                self.relax(blocks)
+        for region in self.opened:
+            self.reopen(*region)
+        self.opened = []
+
+    def mark(self, x0, y0, x1, y1):
+        block = FoodField.BLOCK
+        for by in range(y0 // block, (y1 - 1) // block + 1):
+            for bx in range(x0 // block, (x1 - 1) // block + 1):
+                self.dirty[(bx, by)] = None
+
+    def add_source(self, x, y):
+        self.sources[y, x] = True
+        self.added.append((x, y))
+        self.close(x - self.reach, y - self.reach, x + self.reach + 1, y + self.reach + 1)
+
+    def remove_source(self, x, y):
+        self.sources[y, x] = False
+        self.dirty[(x // FoodField.BLOCK, y // FoodField.BLOCK)] = None
+
+    def terrain_changed(self, xs, ys):
+        x0, y0, x1, y1 = int(min(xs)), int(min(ys)), int(max(xs)) + 1, int(max(ys)) + 1
+        self.mark(x0, y0, x1, y1)
+        self.close(x0 - self.reach, y0 - self.reach, x1 + self.reach, y1 + self.reach)
+
+    def close(self, x0, y0, x1, y1):
+        self.clear_grid[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)] = False
+        self.opened.append((x0, y0, x1, y1))
+
+    def may_eat(self, x, y, radius):
+        i = y * self.width + x
+        return self.dist[i] <= radius or not self.clear[i] or radius > self.reach
+
+    def hungry(self, cells, xs, ys, radius):
+        if radius > self.reach:
+            return np.flatnonzero(window_counts(cells(), xs, ys, radius, self.width, self.height))
+        return foragers(self.grid, self.clear_grid, cells, xs, ys, radius)
+
+    def downhill(self, x, y):
+        dist, width, height = self.dist, self.width, self.height
+        best = dist[y * width + x]
+        if best == FoodField.UNREACHED:
+            return None
+        target = x, y
+        for dx, dy in FoodField.OFFSETS[1:]:
+            nx, ny = (x + dx) % width, (y + dy) % height
+            d = dist[ny * width + nx]
+            if d < best:
+                best, target = d, (nx, ny)
+        return target
+
+
 class Village:
+    __slots__ = ("x", "y", "race", "population", "level", "id")
+
     def __init__(self, x, y, race):
         self.x = x
         self.y = y
         self.race = race
         self.population = 1
         self.level = 1
+        self.id = None
 
     def grow(self):
         if self.population > 5 and self.level < 2:
@@ -177,80 +808,109 @@ class Village:
         elif self.population > 12 and self.level < 3:
             self.level = 3
 
+    def join(self, count=1):
+        self.population += count
+        self.grow()
+
+    def leave(self, count=1):
+        self.population -= count
+        return self.population <= 0
+
+
+class VillageRegistry:
+    def __init__(self, tile_size=8):
+        self.items = {}
+        self.grid = SpatialHash(tile_size)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, village):
+        return village in self.items
+
+    def add(self, village):
+        self.items[village] = None
+        self.grid.insert(village)
+
+    def remove(self, village):
+        del self.items[village]
+        self.grid.remove(village)
+
+    def near(self, x, y, radius):
+        return self.grid.query(x, y, radius)
+
+    def too_close(self, x, y, min_distance):
+        return any(math.sqrt((x - v.x) ** 2 + (y - v.y) ** 2) < min_distance
+                   for v in self.near(x, y, math.ceil(min_distance)))
+
 
 class Agent:
+    __slots__ = ("x", "y", "race", "race_id", "energy", "age", "village", "id", "index", "color", "infected")
     HUMAN = "Human"
     ELF = "Elf"
     DWARF = "Dwarf"
     ORC = "Orc"
+    RACES = [HUMAN, ELF, DWARF, ORC]
+    COLORS = {HUMAN: RED, ELF: GREEN, DWARF: BROWN, ORC: PURPLE}
+    RACE_IDS = dict(zip(RACES, range(len(RACES))))
 
     def __init__(self, x, y, race=None):
+        self.id = None
+        self.index = -1
+        self.reset(x, y, race or random.choice(Agent.RACES))
+
+    def reset(self, x, y, race):
         self.x = x
         self.y = y
-        self.race = race or random.choice([Agent.HUMAN, Agent.ELF, Agent.DWARF, Agent.ORC])
+        self.race = race
+        self.race_id = Agent.RACE_IDS[race]
         self.energy = settings.initial_energy
         self.age = 0
-        self.max_age = self.get_max_age()
         self.village = None
-        self.color = self.get_race_color()
-        self.strength = self.get_race_strength()
-        self.speed = self.get_race_speed()
-
-    def get_max_age(self):
-        ages = {Agent.HUMAN: settings.human_max_age, Agent.ELF: settings.elf_max_age,
-                Agent.DWARF: settings.dwarf_max_age, Agent.ORC: settings.orc_max_age}
-        return ages.get(self.race, 500)
-
-    def get_race_color(self):
-        colors = {Agent.HUMAN: RED, Agent.ELF: GREEN, Agent.DWARF: BROWN, Agent.ORC: PURPLE}
-        return colors.get(self.race, WHITE)
-
-    def get_race_strength(self):
-        strength = {Agent.HUMAN: settings.human_strength, Agent.ELF: settings.elf_strength,
-                    Agent.DWARF: settings.dwarf_strength, Agent.ORC: settings.orc_strength}
-        return strength.get(self.race, 5)
-
-    def get_race_speed(self):
-        speed = {Agent.HUMAN: settings.human_speed, Agent.ELF: settings.elf_speed, Agent.DWARF: settings.dwarf_speed,
-                 Agent.ORC: settings.orc_speed}
-        return speed.get(self.race, 1.0)
-
-    def move(self, terrain):
-        for _ in range(int(self.speed)):
-            dx = random.choice([-1, 0, 1])
-            dy = random.choice([-1, 0, 1])
-            new_x = (self.x + dx) % (WIDTH // CELL_SIZE)
-            new_y = (self.y + dy) % (HEIGHT // CELL_SIZE)
+        self.color = Agent.COLORS[race]
+        self.infected = 0
+
+    def move(self, terrain, grid, steps, offset, moves, energy_loss, field=None):
+        old_x, old_y = self.x, self.y
+        for i in range(offset, offset + 2 * moves, 2):
+            if field:
+                target = field.downhill(self.x, self.y)
+                if target:
+                    self.x, self.y = target
+                    continue
+            new_x = (self.x + steps[i]) % terrain.width
+            new_y = (self.y + steps[i + 1]) % terrain.height
             if terrain.is_walkable(new_x, new_y):
                 self.x = new_x
                 self.y = new_y
-        self.energy -= settings.energy_loss
+        grid.move(self, old_x, old_y)
+        self.energy -= energy_loss
         self.age += 1
 
-    def eat(self, food_list):
-        for food in food_list[:]:
-            if abs(self.x - food.x) <= settings.food_search_radius and abs(
-                    self.y - food.y) <= settings.food_search_radius:
-                self.energy = min(self.energy + settings.energy_from_food, settings.max_energy)
-                food_list.remove(food)
-                break
+    def eat(self, food_store, radius, gain, max_energy, field=None):
+        if food_store.count and (field is None or field.may_eat(self.x, self.y, radius)):
+            food = food_store.take_near(self.x, self.y, radius)
+            if food:
+                self.energy = min(self.energy + gain, max_energy)
+            return food
+        return None
 
-    def reproduce(self, agents_list, terrain):
-        if (
-                self.energy >= settings.reproduction_energy and self.age < self.max_age * settings.max_reproduction_age_ratio and self.age > settings.min_reproduction_age):
-            nearby_agents = sum(
-                1 for a in agents_list if abs(a.x - self.x) <= 5 and abs(a.y - self.y) <= 5 and a.race == self.race)
-            if nearby_agents < settings.max_nearby_agents and random.random() < settings.reproduction_chance:
-                self.energy -= settings.reproduction_cost
-                child = Agent(self.x, self.y, self.race)
-                child.village = self.village
-                agents_list.append(child)
-
-    def fight(self, other_agent):
+    def reproduce(self, grid, fertile_age, min_age, energy_needed, cost, max_nearby):
+        if self.energy >= energy_needed and min_age < self.age < fertile_age:
+            nearby_agents = sum(1 for a in grid.query(self.x, self.y, 5) if a.race == self.race)
+            if nearby_agents < max_nearby:
+                self.energy -= cost
+                return True
+        return False
+
+    def fight(self, other_agent, roll, my_bonus, enemy_bonus, death_chance, strength):
         if self.race != other_agent.race:
-            if random.random() < settings.fight_death_chance:
-                my_power = self.strength + random.randint(0, 3)
-                enemy_power = other_agent.strength + random.randint(0, 3)
+            if roll < death_chance:
+                my_power = strength[self.race_id] + my_bonus
+                enemy_power = strength[other_agent.race_id] + enemy_bonus
                 if my_power > enemy_power:
                     return other_agent
                 elif enemy_power > my_power:
@@ -260,291 +920,2199 @@ class Agent:
     def build_village(self, villages, terrain):
         if self.energy >= settings.village_energy_cost and not self.village:
             if terrain.is_walkable(self.x, self.y):
-                for v in villages:
-                    dist = math.sqrt((self.x - v.x) ** 2 + (self.y - v.y) ** 2)
-                    if dist < settings.village_min_distance:
-                        return
+                if villages.too_close(self.x, self.y, settings.village_min_distance):
+                    return
                 village = Village(self.x, self.y, self.race)
-                villages.append(village)
+                villages.add(village)
                 self.village = village
                 self.energy -= settings.village_build_cost
+                return village
+        return None
+
+
+class RaceTable:
+    COLUMNS = {"max_age": "d", "strength": "d", "speed": "d", "moves": "i", "fertile_age": "d"}
+
+    def __init__(self):
+        self.refresh()
+
+    def refresh(self):
+        prefixes = [race.lower() for race in Agent.RACES]
+        self.max_age = [getattr(settings, prefix + "_max_age") for prefix in prefixes]
+        self.strength = [getattr(settings, prefix + "_strength") for prefix in prefixes]
+        self.speed = [getattr(settings, prefix + "_speed") for prefix in prefixes]
+        self.moves = [int(speed) for speed in self.speed]
+        self.fertile_age = [max_age * settings.max_reproduction_age_ratio for max_age in self.max_age]
+        if np is not None:
+            self.columns = {name: np.array(getattr(self, name), dtype=np.int32 if kind == "i" else np.float64)
+                            for name, kind in self.COLUMNS.items()}
+
+    def column(self, name, races):
+        return self.columns[name][races]
+
+
+race_table = RaceTable()
 
 
 class Disaster:
+    KINDS = ("meteor", "lightning", "plague", "fire", "flood")
+
     @staticmethod
-    def meteor_strike(x, y, agents, terrain):
-        casualties = []
+    def meteor_strike(x, y, world):
         radius = settings.meteor_radius
-        for agent in agents[:]:
-            dist = math.sqrt((agent.x - x) ** 2 + (agent.y - y) ** 2)
-            if dist < radius:
-                casualties.append(agent)
+        casualties = [agent for agent in world.agent_grid.query(x, y, radius)
+                      if (agent.x - x) ** 2 + (agent.y - y) ** 2 < radius * radius]
         for agent in casualties:
-            agents.remove(agent)
-        for dx in range(-radius, radius):
-            for dy in range(-radius, radius):
-                nx, ny = x + dx, y + dy
-                if 0 <= nx < WIDTH // CELL_SIZE and 0 <= ny < HEIGHT // CELL_SIZE:
-                    if (dx * dx + dy * dy) < radius * radius:
-                        terrain.grid[ny][nx] = Terrain.SAND
+            world.remove_agent(agent, "meteor")
+        Disaster.scorch(x, y, radius, world.terrain)
         return len(casualties)
 
     @staticmethod
-    def lightning_strike(x, y, agents):
-        for agent in agents[:]:
-            if agent.x == x and agent.y == y:
-                agents.remove(agent)
-                return True
+    def scorch(x, y, radius, terrain):
+        cells = [(nx, ny) for ny in range(max(0, y - radius), min(terrain.height, y + radius))
+                 for nx in range(max(0, x - radius), min(terrain.width, x + radius))
+                 if (nx - x) ** 2 + (ny - y) ** 2 < radius * radius]
+        terrain.paint([nx for nx, _ in cells], [ny for _, ny in cells], Terrain.SAND)
+
+    @staticmethod
+    def lightning_strike(x, y, world):
+        for agent in world.agent_grid.at(x, y):
+            world.remove_agent(agent, "lightning")
+            return True
         return False
 
 
-def main():
+class Hazard:
+    FIRE = "fire"
+    FLOOD = "flood"
+    KINDS = (FIRE, FLOOD)
+    SOURCES = {FIRE: Terrain.GRASS, FLOOD: Terrain.SAND}
+    SCARS = {FIRE: Terrain.SAND, FLOOD: Terrain.WATER}
+
+    def __init__(self, kind, xs, ys, age=0):
+        self.kind = kind
+        self.xs = np.array(xs, dtype=np.int32)
+        self.ys = np.array(ys, dtype=np.int32)
+        self.age = age
+
+    def __len__(self):
+        return len(self.xs)
+
+    def chances(self):
+        if self.kind == Hazard.FIRE:
+            return settings.fire_spread_chance, settings.fire_burnout_chance
+        return settings.flood_spread_chance, settings.flood_recede_chance
+
+    def step(self, terrain, rng):
+        width, height = terrain.width, terrain.height
+        front = np.sort(self.ys.astype(np.int64) * width + self.xs)
+        xs, ys = front % width, front // width
+        nx, ny = xs[:, None] + (0, -1, 1, 0), ys[:, None] + (-1, 0, 0, 1)
+        inside = (nx >= 0) & (nx < width) & (ny >= 0) & (ny < height)
+        near = np.unique(ny[inside] * width + nx[inside])
+        near = near[front[np.searchsorted(front, near).clip(max=len(front) - 1)] != near]
+        near = near[terrain.types(near % width, near // width) == Hazard.SOURCES[self.kind]]
+        spread, end = self.chances()
+        caught = near[rng.random(len(near)) < spread]
+        ended = rng.random(len(front)) < end
+        self.age += 1
+        cells = np.sort(np.concatenate([front[~ended], caught]))
+        self.xs, self.ys = (cells % width).astype(np.int32), (cells // width).astype(np.int32)
+        if self.kind == Hazard.FIRE:
+            burning = np.concatenate([front, caught])
+            return burning % width, burning // width, xs[ended], ys[ended]
+        return caught % width, caught // width, caught % width, caught // width
+
+
+def zero_clock():
+    return 0.0
+
+
+class Profiler:
+    def __init__(self, window=120, enabled=False):
+        self.window = window
+        self.enabled = enabled
+        self.samples = {}
+        self.started = {}
+
+    def start(self, name):
+        if self.enabled:
+            self.started[name] = time.perf_counter()
+
+    def stop(self, name):
+        if self.enabled and name in self.started:
+            self.record(name, time.perf_counter() - self.started.pop(name))
+
+    def call(self, name, func, *args):
+        if not self.enabled:
+            return func(*args)
+        start = time.perf_counter()
+        result = func(*args)
+        self.record(name, time.perf_counter() - start)
+        return result
+
+    def clock(self):
+        return time.perf_counter if self.enabled else zero_clock
+
+    def record(self, name, seconds):
+        samples = self.samples.get(name)
+        if samples is None:
+            samples = self.samples[name] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def stats(self):
+        report = {}
+        for name, samples in self.samples.items():
+            if not samples:
+                continue
+            ordered = sorted(samples)
+            last = len(ordered) - 1
+            report[name] = {
+                "count": len(ordered),
+                "mean_ms": sum(ordered) / len(ordered) * 1000,
+                "p50_ms": ordered[last // 2] * 1000,
+                "p95_ms": ordered[round(last * 0.95)] * 1000,
+                "p99_ms": ordered[round(last * 0.99)] * 1000,
+                "max_ms": ordered[last] * 1000,
+            }
+        return report
+
+    def dump(self, path, **extra):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(extra, window=self.window, phases=self.stats()), f, indent=2)
+
+
+class RandomStream:
+    def __init__(self, seed, stream):
+        if np is None:
+            self.rng = random.Random(None if seed is None else f"{seed}/{stream}")
+        else:
+            self.rng = np.random.default_rng(None if seed is None else [seed, stream])
+
+    def random(self):
+        return float(self.rng.random())
+
+    def randrange(self, low, high):
+        if np is None:
+            return self.rng.randrange(low, high)
+        return int(self.rng.integers(low, high))
+
+    def choice(self, items):
+        return items[self.randrange(0, len(items))]
+
+    def floats(self, n):
+        if np is None:
+            return [self.rng.random() for _ in range(n)]
+        return self.rng.random(n).tolist()
+
+    def ints(self, low, high, n):
+        if np is None:
+            return [self.rng.randrange(low, high) for _ in range(n)]
+        return self.rng.integers(low, high, n).tolist()
+
+    def state(self):
+        if np is None:
+            version, internal, gauss = self.rng.getstate()
+            return [version, list(internal), gauss]
+        return self.rng.bit_generator.state
+
+    def restore(self, state):
+        if np is None:
+            version, internal, gauss = state
+            self.rng.setstate((version, tuple(internal), gauss))
+        else:
+            self.rng.bit_generator.state = state
+
+
+class Stats:
+    def __init__(self):
+        self.population = dict.fromkeys(Agent.RACES, 0)
+        self.births = dict.fromkeys(Agent.RACES, 0)
+        self.deaths = dict.fromkeys(EventLog.CAUSES, 0)
+
+    def born(self, race, count=1):
+        self.population[race] += count
+        self.births[race] += count
+
+    def died(self, race, cause, count=1):
+        self.population[race] -= count
+        self.deaths[cause] += count
+
+    def state(self):
+        return {"births": self.births, "deaths": self.deaths}
+
+    def restore(self, state, population):
+        self.population = dict(population)
+        self.births.update(state.get("births", dict.fromkeys(Agent.RACES, 0)))
+        self.deaths.update(state.get("deaths", dict.fromkeys(EventLog.CAUSES, 0)))
+
+
+class World:
+    PHASES = ("update_agents", "resolve_fights", "spawn_food", "roll_disaster", "spread_hazards")
+    STREAMS = ("populate", "move", "reproduce", "village", "fight", "food", "disaster", "hazard", "plague")
+
+    def __init__(self, seed=None, generate=True, width=GRID_WIDTH, height=GRID_HEIGHT):
+        self.seed = seed
+        if seed is not None:
+            random.seed(seed)
+        race_table.refresh()
+        self.streams = {name: RandomStream(seed, Terrain.SEED_STREAM + 1 + i) for i, name in enumerate(self.STREAMS)}
+        self.width = width
+        self.height = height
+        self.tick = 0
+        self.log = None
+        self.telemetry = None
+        self.next_village_id = 0
+        self.profiler = Profiler()
+        self.terrain = Terrain(width, height, generate, seed)
+        self.food = FoodStore()
+        self.villages = VillageRegistry()
+        self.hazards = []
+        self.active = None
+        self.setup_agents()
+        if generate:
+            self.populate()
+
+    def setup_agents(self):
+        self.agents = []
+        self.agent_grid = SpatialHash()
+        self.agent_pool = []
+        self.sick = {}
+        self.stats = Stats()
+        self.next_agent_id = 0
+
+    def populate(self):
+        races_positions = [(Agent.HUMAN, 5, 5), (Agent.ELF, self.width - 6, 5),
+                           (Agent.DWARF, 5, self.height - 6),
+                           (Agent.ORC, self.width - 6, self.height - 6)]
+
+        rng = self.streams["populate"]
+        for race, base_x, base_y in races_positions:
+            offsets = rng.ints(-3, 4, 24)
+            for i in range(12):
+                x = max(0, min(self.width - 1, base_x + offsets[2 * i]))
+                y = max(0, min(self.height - 1, base_y + offsets[2 * i + 1]))
+                if self.terrain.is_walkable(x, y):
+                    self.add_agent(x, y, race)
+
+        count = int(settings.initial_food)
+        for x, y in zip(rng.ints(0, self.width, count), rng.ints(0, self.height, count)):
+            if self.terrain.is_walkable(x, y):
+                self.add_food(x, y)
+
+    def add_agent(self, x, y, race=None):
+        agent = self.new_agent(x, y, race or self.streams["populate"].choice(Agent.RACES))
+        self.insert_agent(agent)
+        self.register_birth(agent)
+        return agent
+
+    def new_agent(self, x, y, race):
+        if not self.agent_pool:
+            return Agent(x, y, race)
+        agent = self.agent_pool.pop()
+        agent.reset(x, y, race)
+        return agent
+
+    def insert_agent(self, agent):
+        agent.index = len(self.agents)
+        self.agents.append(agent)
+        self.agent_grid.insert(agent)
+
+    def breed(self, parent):
+        child = self.new_agent(parent.x, parent.y, parent.race)
+        child.village = parent.village
+        if child.village:
+            child.village.join()
+        self.register_birth(child)
+        return child
+
+    def register_birth(self, agent):
+        agent.id = self.next_agent_id
+        self.next_agent_id += 1
+        self.stats.born(agent.race)
+        if self.log:
+            self.log.birth(agent.id, agent.x, agent.y, agent.race_id,
+                           agent.village.id if agent.village else -1)
+
+    def register_village(self, village, founder_id):
+        village.id = self.next_village_id
+        self.next_village_id += 1
+        if self.log:
+            self.log.village_founded(village.id, village.x, village.y, Agent.RACES.index(village.race), founder_id)
+
+    def remove_agent(self, agent, cause):
+        last = self.agents.pop()
+        if last is not agent:
+            self.agents[agent.index] = last
+            last.index = agent.index
+        self.agent_grid.remove(agent)
+        self.sick.pop(agent, None)
+        self.stats.died(agent.race, cause)
+        if self.log:
+            self.log.death(agent.id, cause)
+        if agent.village:
+            if agent.village.leave():
+                self.villages.remove(agent.village)
+                if self.log:
+                    self.log.village_removed(agent.village.id)
+            agent.village = None
+        self.agent_pool.append(agent)
+
+    def add_food(self, x, y):
+        self.food.add(x, y)
+        if self.log:
+            self.log.food_added(x, y)
+
+    def meteor_strike(self, x, y):
+        if self.log:
+            self.log.meteor(x, y, settings.meteor_radius)
+        return Disaster.meteor_strike(x, y, self)
+
+    def lightning_strike(self, x, y):
+        if self.log:
+            self.log.lightning(x, y)
+        return Disaster.lightning_strike(x, y, self)
+
+    def infect(self, x, y):
+        agents = [agent for agent in self.agent_grid.query(x, y, 1) if not agent.infected]
+        for agent in agents:
+            agent.infected = 1
+            self.sick[agent] = None
+        return len(agents)
+
+    def start_hazard(self, kind, x, y):
+        if np is None:
+            return None
+        if kind == Hazard.FIRE and self.terrain.get(x, y) != Terrain.GRASS:
+            return None
+        if kind == Hazard.FLOOD:
+            if self.terrain.get(x, y) == Terrain.MOUNTAIN:
+                return None
+            self.paint([x], [y], Terrain.WATER)
+            self.kill_cells([x], [y], "flood")
+        hazard = Hazard(kind, [x], [y])
+        self.hazards.append(hazard)
+        return hazard
+
+    def disaster(self, kind, x, y):
+        if kind == "meteor":
+            return self.meteor_strike(x, y)
+        if kind == "lightning":
+            return self.lightning_strike(x, y)
+        if kind == "plague":
+            return self.infect(x, y)
+        return self.start_hazard(kind, x, y)
+
+    def paint(self, xs, ys, terrain_type):
+        self.terrain.paint(xs, ys, terrain_type)
+        if self.log and len(xs):
+            self.log.terrain(xs, ys, terrain_type)
+
+    def kill_cells(self, xs, ys, cause):
+        if len(xs) == 0 or not self.agents:
+            return 0
+        xs, ys = np.asarray(xs, dtype=np.int64), np.asarray(ys, dtype=np.int64)
+        agents = self.agent_grid.within(int(xs.min()), int(ys.min()), int(xs.max()), int(ys.max()))
+        if not agents:
+            return 0
+        cells = set((ys * self.width + xs).tolist())
+        killed = 0
+        for agent in agents:
+            if agent.y * self.width + agent.x in cells:
+                self.remove_agent(agent, cause)
+                killed += 1
+        return killed
+
+    def step(self, n=1):
+        profiler = self.profiler
+        for _ in range(n):
+            for phase in self.PHASES:
+                profiler.call(phase, getattr(self, phase))
+            self.tick += 1
+            if self.log:
+                self.log.end_tick(self)
+            if self.telemetry:
+                self.telemetry.end_tick(self)
+
+    def close(self):
+        pass
+
+    def update_agents(self):
+        profiler = self.profiler
+        clock = profiler.clock()
+        move_time = eat_time = reproduce_time = 0.0
+        log = self.log
+        agents = self.agents
+        terrain, grid, food_store, field = self.terrain, self.agent_grid, self.food, self.food_field()
+        moves, fertile_age, max_age = race_table.moves, race_table.fertile_age, race_table.max_age
+        energy_loss, birth_chance, build_chance = settings.energy_loss, settings.reproduction_chance, \
+            settings.village_build_chance
+        radius, gain, max_energy = int(settings.food_search_radius), settings.energy_from_food, settings.max_energy
+        min_age, birth_energy, birth_cost, max_nearby = settings.min_reproduction_age, settings.reproduction_energy, \
+            settings.reproduction_cost, settings.max_nearby_agents
+        born = []
+        stride, steps, births, builds = self.draw_agent_rolls()
+        for i in range(len(agents) - 1, -1, -1):
+            agent = agents[i]
+            x, y = agent.x, agent.y
+            start = clock()
+            agent.move(terrain, grid, steps, i * stride, moves[agent.race_id], energy_loss, field)
+            moved = clock()
+            food = agent.eat(food_store, radius, gain, max_energy, field)
+            eaten = clock()
+            if births[i] < birth_chance and agent.reproduce(grid, fertile_age[agent.race_id], min_age, birth_energy,
+                                                            birth_cost, max_nearby):
+                born.append(self.breed(agent))
+            move_time += moved - start
+            eat_time += eaten - moved
+            reproduce_time += clock() - eaten
+            if log:
+                if agent.x != x or agent.y != y:
+                    log.moved(agent.id, agent.x - x, agent.y - y)
+                if food:
+                    log.food_eaten(food.x, food.y)
+            if food:
+                self.food.release(food)
+            self.finish_agent(agent, builds[i] < build_chance, max_age[agent.race_id])
+        for child in born:
+            self.insert_agent(child)
+        if profiler.enabled:
+            profiler.record("update_agents.move", move_time)
+            profiler.record("update_agents.eat", eat_time)
+            profiler.record("update_agents.reproduce", reproduce_time)
+
+    def draw_agent_rolls(self):
+        n = len(self.agents)
+        stride = 2 * max(race_table.moves)
+        streams = self.streams
+        return (stride, streams["move"].ints(-1, 2, n * stride), streams["reproduce"].floats(n),
+                streams["village"].floats(n))
+
+    def finish_agent(self, agent, build, max_age):
+        if build:
+            village = agent.build_village(self.villages, self.terrain)
+            if village:
+                self.register_village(village, agent.id)
+        if agent.energy <= 0:
+            self.remove_agent(agent, "starvation")
+        elif agent.age >= max_age:
+            self.remove_agent(agent, "age")
+
+    def resolve_fights(self):
+        rng = self.streams["fight"]
+        if rng.random() < settings.fight_chance:
+            groups = self.agent_grid.colocated()
+            pairs = sum(len(group) * (len(group) - 1) // 2 for group in groups)
+            rolls = rng.floats(pairs)
+            bonuses = rng.ints(0, 4, 2 * pairs)
+            death_chance, strength = settings.fight_death_chance, race_table.strength
+            k = 0
+            for group in groups:
+                for i, agent1 in enumerate(group):
+                    for j in range(i + 1, len(group)):
+                        agent2 = group[j]
+                        k += 1
+                        if agent1 not in self.agent_grid:
+                            k += len(group) - j - 1
+                            break
+                        if agent2 not in self.agent_grid:
+                            continue
+                        loser = agent1.fight(agent2, rolls[k - 1], bonuses[2 * k - 2], bonuses[2 * k - 1], death_chance,
+                                             strength)
+                        if loser:
+                            self.remove_agent(loser, "fight")
+
+    def spawn_food(self):
+        rng = self.streams["food"]
+        if len(self.food) < settings.max_food and rng.random() < settings.food_spawn_chance:
+            cell = self.random_cell(rng)
+            if cell and self.terrain.is_walkable(*cell):
+                self.add_food(*cell)
+
+    def roll_disaster(self):
+        rng = self.streams["disaster"]
+        if rng.random() < settings.disaster_chance:
+            cell = self.random_cell(rng)
+            if cell is None:
+                return
+            self.disaster(rng.choice(Disaster.KINDS if np is not None else Disaster.KINDS[:3]), *cell)
+
+    def spread_hazards(self):
+        if self.hazards:
+            rng = self.streams["hazard"].rng
+            kills = {}
+            for hazard in self.hazards:
+                kill_xs, kill_ys, xs, ys = hazard.step(self.terrain, rng)
+                self.paint(xs, ys, Hazard.SCARS[hazard.kind])
+                kills.setdefault(hazard.kind, []).append((kill_xs, kill_ys))
+            for cause, cells in kills.items():
+                self.kill_cells(np.concatenate([xs for xs, _ in cells]), np.concatenate([ys for _, ys in cells]), cause)
+            self.hazards = [hazard for hazard in self.hazards if len(hazard)]
+        self.spread_plague()
+
+    def spread_plague(self):
+        if not self.sick:
+            return
+        rng = self.streams["plague"]
+        sick = sorted(self.sick, key=lambda agent: agent.id)
+        for agent in sick:
+            for other in self.agent_grid.query(agent.x, agent.y, 1):
+                if not other.infected and rng.random() < settings.plague_spread_chance:
+                    other.infected = 1
+                    self.sick[other] = None
+        for agent in sick:
+            agent.infected += 1
+            if rng.random() < settings.plague_death_chance:
+                self.remove_agent(agent, "plague")
+            elif agent.infected > settings.plague_duration:
+                agent.infected = 0
+                del self.sick[agent]
+
+    def plague_cases(self):
+        return len(self.sick)
+
+    def food_field(self):
+        field = self.food.field
+        if not settings.foraging or np is None:
+            if field:
+                field.detach()
+                self.food.field = None
+            return None
+        if field is None:
+            field = self.food.field = FoodField(self.terrain, self.food, *self.field_buffers())
+        field.flush()
+        return field
+
+    def field_buffers(self):
+        return None, None
+
+    def random_cell(self, rng):
+        x, y = rng.randrange(0, self.width), rng.randrange(0, self.height)
+        interval = int(settings.inactive_chunk_interval)
+        if interval == 1 or (interval > 1 and self.tick % interval == 0):
+            return x, y
+        if (x // CHUNK_SIZE, y // CHUNK_SIZE) not in self.active_chunks():
+            return None
+        return x, y
+
+    def occupied_chunks(self):
+        return {(a.x // CHUNK_SIZE, a.y // CHUNK_SIZE) for a in self.agents}
+
+    def active_chunks(self):
+        if self.active is not None and self.active[0] == self.tick:
+            return self.active[1]
+        columns, rows = -(-self.width // CHUNK_SIZE), -(-self.height // CHUNK_SIZE)
+        active = set()
+        for cx, cy in self.occupied_chunks():
+            for ny in range(max(0, cy - 1), min(rows, cy + 2)):
+                for nx in range(max(0, cx - 1), min(columns, cx + 2)):
+                    active.add((nx, ny))
+        self.active = (self.tick, active)
+        return active
+
+    def race_counts(self):
+        return dict(self.stats.population)
+
+    def count_races(self):
+        return {race: sum(1 for a in self.agents if a.race == race) for race in
+                [Agent.HUMAN, Agent.ELF, Agent.DWARF, Agent.ORC]}
+
+    def agent_columns(self, village_index):
+        agents = self.agents
+        agent_index = {agent: i for i, agent in enumerate(agents)}
+        grid_order = [agent_index[agent] for bucket in self.agent_grid.buckets.values() for agent in bucket]
+        return [
+            ("agent_id", array("q", [a.id for a in agents])),
+            ("agent_x", array("i", [a.x for a in agents])),
+            ("agent_y", array("i", [a.y for a in agents])),
+            ("agent_energy", array("d", [a.energy for a in agents])),
+            ("agent_age", array("i", [a.age for a in agents])),
+            ("agent_race", array("b", [a.race_id for a in agents])),
+            ("agent_village", array("i", [village_index[a.village] if a.village else -1 for a in agents])),
+            ("agent_infected", array("i", [a.infected for a in agents])),
+            ("agent_grid_order", array("i", grid_order)),
+        ]
+
+    def restore_agents(self, columns, villages):
+        for i in range(len(columns["agent_x"])):
+            agent = self.add_agent(columns["agent_x"][i], columns["agent_y"][i], Agent.RACES[columns["agent_race"][i]])
+            agent.id = columns["agent_id"][i]
+            agent.energy = columns["agent_energy"][i]
+            agent.age = columns["agent_age"][i]
+            village = columns["agent_village"][i]
+            agent.village = villages[village] if village >= 0 else None
+            if "agent_infected" in columns and columns["agent_infected"][i]:
+                agent.infected = columns["agent_infected"][i]
+                self.sick[agent] = None
+        if "agent_grid_order" in columns:
+            self.agent_grid = SpatialHash(self.agent_grid.tile_size)
+            for i in columns["agent_grid_order"]:
+                self.agent_grid.insert(self.agents[i])
+
+    def rng_state(self):
+        version, state, gauss = random.getstate()
+        return {"random": [version, list(state), gauss],
+                "streams": {name: stream.state() for name, stream in self.streams.items()}}
+
+    def restore_rng(self, state):
+        version, internal, gauss = state["random"]
+        random.setstate((version, tuple(internal), gauss))
+        for name, stream_state in state.get("streams", {}).items():
+            self.streams[name].restore(stream_state)
+
+    def agent_cells(self):
+        xs = np.fromiter((a.x for a in self.agents), dtype=np.int32, count=len(self.agents))
+        ys = np.fromiter((a.y for a in self.agents), dtype=np.int32, count=len(self.agents))
+        colors = np.array([a.color for a in self.agents], dtype=np.uint8).reshape(-1, 3)
+        return xs, ys, colors
+
+
+AgentView = namedtuple("AgentView", ["x", "y", "race", "color"])
+
+
+def window_counts(cells, xs, ys, radius, width, height):
+    cells = np.sort(cells)
+    counts = np.zeros(len(xs), dtype=np.int64)
+    left = np.maximum(xs - radius, 0)
+    right = np.minimum(xs + radius, width - 1)
+    for dy in range(-radius, radius + 1):
+        row = ys.astype(np.int64) + dy
+        found = np.searchsorted(cells, row * width + right, "right") - np.searchsorted(cells, row * width + left)
+        counts += np.where((row >= 0) & (row < height), found, 0)
+    return counts
+
+
+def foragers(dist, clear, cells, xs, ys, radius):
+    near = dist[ys, xs] <= radius
+    unsure = np.flatnonzero(~near & ~clear[ys, xs])
+    if len(unsure):
+        height, width = dist.shape
+        near[unsure] = window_counts(cells(), xs[unsure], ys[unsure], radius, width, height) > 0
+    return np.flatnonzero(near)
+
+
+def downhill_steps(field, x, y):
+    height, width = field.shape
+    offsets = np.array(FoodField.OFFSETS)
+    around = field[(y[:, None] + offsets[:, 1]) % height, (x[:, None] + offsets[:, 0]) % width]
+    best = around.argmin(axis=1)
+    return offsets[best, 0], offsets[best, 1], around[:, 0] < FoodField.UNREACHED
+
+
+def move_cells(x, y, steps, walkable, rng, field=None):
+    height, width = walkable.shape
+    for step in range(int(steps.max())):
+        dx = rng.integers(-1, 2, len(x))
+        dy = rng.integers(-1, 2, len(x))
+        if field is not None:
+            field_dx, field_dy, guided = downhill_steps(field, x, y)
+            dx = np.where(guided, field_dx, dx)
+            dy = np.where(guided, field_dy, dy)
+        new_x = (x + dx) % width
+        new_y = (y + dy) % height
+        ok = (steps > step) & walkable[new_y, new_x]
+        x[ok] = new_x[ok]
+        y[ok] = new_y[ok]
+
+
+def crowded(ready, cells, x, y, race, width, height):
+    for race_id in range(len(Agent.RACES)):
+        candidates = ready & (race == race_id)
+        if not candidates.any():
+            continue
+        nearby = window_counts(cells[race_id], x[candidates], y[candidates], 5, width, height)
+        ready[np.flatnonzero(candidates)[nearby >= settings.max_nearby_agents]] = False
+    return ready
+
+
+def fight_survivors(cells, race, strength, rng):
+    order = np.argsort(cells, kind="stable")
+    cells = cells[order]
+    alive = np.ones(len(cells), dtype=bool)
+    offset = 1
+    while offset < len(order):
+        same = cells[:-offset] == cells[offset:]
+        if not same.any():
+            break
+        first, second = order[:-offset][same], order[offset:][same]
+        pairs = alive[first] & alive[second] & (race[first] != race[second])
+        pairs &= rng.random(len(first)) < settings.fight_death_chance
+        first, second = first[pairs], second[pairs]
+        my_power = strength[first] + rng.integers(0, 4, len(first))
+        enemy_power = strength[second] + rng.integers(0, 4, len(second))
+        alive[second[my_power > enemy_power]] = False
+        alive[first[enemy_power > my_power]] = False
+        offset += 1
+    return alive
+
+
+class ArrayPopulation:
+    FIELDS = {"id": np.int64, "x": np.int32, "y": np.int32, "energy": np.float64, "age": np.int32, "race": np.int8,
+              "village": np.int32, "infected": np.int32} if np is not None else {}
+    RACE_COLORS = [RED, GREEN, BROWN, PURPLE]
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.capacity = max(1, capacity)
+        for name, dtype in self.FIELDS.items():
+            setattr(self, "_" + name, self.allocate(name, dtype))
+
+    def allocate(self, name, dtype):
+        return np.zeros(self.capacity, dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        x, y, race = self.x, self.y, self.race
+        for i in range(self.size):
+            yield AgentView(int(x[i]), int(y[i]), Agent.RACES[race[i]], self.RACE_COLORS[race[i]])
+
+    def __getattr__(self, name):
+        if name in ArrayPopulation.FIELDS:
+            return getattr(self, "_" + name)[:self.size]
+        raise AttributeError(name)
+
+    def reserve(self, extra):
+        needed = self.size + extra
+        if needed <= self.capacity:
+            return
+        while self.capacity < needed:
+            self.capacity *= 2
+        for name in self.FIELDS:
+            old = getattr(self, "_" + name)
+            new = self.allocate(name, old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, "_" + name, new)
+
+    def add_many(self, xs, ys, races, ids, villages=None):
+        count = len(xs)
+        if count == 0:
+            return
+        self.reserve(count)
+        part = slice(self.size, self.size + count)
+        self._id[part] = ids
+        self._x[part] = xs
+        self._y[part] = ys
+        self._race[part] = races
+        self._energy[part] = settings.initial_energy
+        self._age[part] = 0
+        self._village[part] = -1 if villages is None else villages
+        self._infected[part] = 0
+        self.size += count
+
+    def keep(self, mask):
+        count = int(mask.sum())
+        if count == self.size:
+            return
+        for name in self.FIELDS:
+            data = getattr(self, "_" + name)
+            data[:count] = data[:self.size][mask]
+        self.size = count
+
+
+class ArrayWorld(World):
+    def __init__(self, seed=None, capacity=1024, generate=True, width=GRID_WIDTH, height=GRID_HEIGHT):
+        if np is None:
+            raise RuntimeError("ArrayWorld vyžaduje numpy")
+        self.capacity = capacity
+        super().__init__(seed, generate, width, height)
+
+    def setup_agents(self):
+        self.population = ArrayPopulation(self.capacity)
+        self.agents = self.population
+        self.village_slots = []
+        self.free_slots = []
+        self.walkable = self.terrain.walkable_array()
+        self.stats = Stats()
+        self.next_agent_id = 0
+
+    def add_agent(self, x, y, race=None):
+        race = race or self.streams["populate"].choice(Agent.RACES)
+        self.add_agents([x], [y], [Agent.RACES.index(race)])
+
+    def add_agents(self, xs, ys, races, villages=None):
+        count = len(xs)
+        ids = np.arange(self.next_agent_id, self.next_agent_id + count, dtype=np.int64)
+        self.next_agent_id += count
+        self.population.add_many(xs, ys, races, ids, villages)
+        for race_id, born in enumerate(np.bincount(np.asarray(races, dtype=np.int64), minlength=len(Agent.RACES))):
+            if born:
+                self.stats.born(Agent.RACES[race_id], int(born))
+        if self.log:
+            for i in range(count):
+                slot = -1 if villages is None else villages[i]
+                self.log.birth(int(ids[i]), int(xs[i]), int(ys[i]), int(races[i]),
+                               self.village_slots[slot].id if slot >= 0 else -1)
+
+    def remove_agent(self, agent, cause):
+        raise NotImplementedError("ArrayWorld nemá objekty agentů, použij remove_row(řádek, příčina)")
+
+    def remove_row(self, row, cause):
+        alive = np.ones(self.population.size, dtype=bool)
+        alive[row] = False
+        self.cull(alive, cause)
+
+    def meteor_strike(self, x, y):
+        pop = self.population
+        radius = settings.meteor_radius
+        if self.log:
+            self.log.meteor(x, y, radius)
+        hit = (pop.x - x) ** 2 + (pop.y - y) ** 2 < radius * radius
+        self.cull(~hit, "meteor")
+        Disaster.scorch(x, y, radius, self.terrain)
+        return int(hit.sum())
+
+    def lightning_strike(self, x, y):
+        pop = self.population
+        hits = np.flatnonzero((pop.x == x) & (pop.y == y))
+        if self.log:
+            self.log.lightning(x, y)
+        if len(hits) == 0:
+            return False
+        self.remove_row(hits[0], "lightning")
+        return True
+
+    def infect(self, x, y):
+        pop = self.population
+        hit = (np.abs(pop.x - x) <= 1) & (np.abs(pop.y - y) <= 1) & (pop.infected == 0)
+        pop.infected[hit] = 1
+        return int(hit.sum())
+
+    def kill_cells(self, xs, ys, cause):
+        pop = self.population
+        if len(xs) == 0 or pop.size == 0:
+            return 0
+        cells = np.asarray(ys, dtype=np.int64) * self.width + np.asarray(xs, dtype=np.int64)
+        hit = np.isin(pop.y.astype(np.int64) * self.width + pop.x, cells)
+        killed = int(hit.sum())
+        if killed:
+            self.cull(~hit, cause)
+        return killed
+
+    def spread_plague(self):
+        pop = self.population
+        infected = pop.infected
+        sick = np.flatnonzero(infected)
+        if len(sick) == 0:
+            return
+        rng = self.streams["plague"].rng
+        x, y = pop.x, pop.y
+        near_x = (x[sick, None] + np.array([-1, 0, 1] * 3)).ravel()
+        near_y = (y[sick, None] + np.repeat([-1, 0, 1], 3)).ravel()
+        inside = (near_x >= 0) & (near_x < self.width) & (near_y >= 0) & (near_y < self.height)
+        near = near_y[inside].astype(np.int64) * self.width + near_x[inside]
+        exposed = np.flatnonzero(np.isin(y.astype(np.int64) * self.width + x, near) & (infected == 0))
+        caught = exposed[rng.random(len(exposed)) < settings.plague_spread_chance]
+        infected[sick] += 1
+        infected[caught] = 1
+        dying = rng.random(len(sick)) < settings.plague_death_chance
+        infected[sick[~dying & (infected[sick] > settings.plague_duration)]] = 0
+        if dying.any():
+            alive = np.ones(pop.size, dtype=bool)
+            alive[sick[dying]] = False
+            self.cull(alive, "plague")
+
+    def plague_cases(self):
+        return int(np.count_nonzero(self.population.infected))
+
+    def update_agents(self):
+        pop = self.population
+        if pop.size == 0:
+            return
+        profiler = self.profiler
+        profiler.call("update_agents.move", self.move_agents)
+        profiler.call("update_agents.eat", self.feed_agents)
+        children = profiler.call("update_agents.reproduce", self.breed_agents)
+        profiler.call("update_agents.villages", self.found_villages)
+        alive = (pop.energy > 0) & (pop.age < race_table.column("max_age", pop.race))
+        causes = np.where(pop.energy <= 0, EventLog.CAUSES.index("starvation"), EventLog.CAUSES.index("age"))
+        self.add_children(*children)
+        born = len(children[0])
+        self.cull(np.concatenate([alive, np.ones(born, dtype=bool)]),
+                  np.concatenate([causes, np.zeros(born, dtype=causes.dtype)]))
+
+    def add_children(self, xs, ys, races, villages):
+        self.add_agents(xs, ys, races, villages)
+        slots, counts = np.unique(villages[villages >= 0], return_counts=True)
+        for slot, count in zip(slots, counts):
+            self.village_slots[slot].join(int(count))
+
+    def cull(self, alive, cause):
+        pop = self.population
+        dead = ~alive
+        races = np.bincount(pop.race[dead], minlength=len(Agent.RACES))
+        if isinstance(cause, str):
+            causes = {cause: int(races.sum())}
+        else:
+            causes = dict(zip(EventLog.CAUSES, np.bincount(cause[dead], minlength=len(EventLog.CAUSES)).tolist()))
+        for race_id, count in enumerate(races.tolist()):
+            self.stats.population[Agent.RACES[race_id]] -= count
+        for name, count in causes.items():
+            self.stats.deaths[name] += count
+        if self.log:
+            for i in np.flatnonzero(~alive):
+                self.log.death(int(pop.id[i]), cause if isinstance(cause, str) else EventLog.CAUSES[cause[i]])
+        slots, counts = np.unique(pop.village[~alive & (pop.village >= 0)], return_counts=True)
+        for slot, count in zip(slots, counts):
+            village = self.village_slots[slot]
+            if village.leave(int(count)):
+                self.villages.remove(village)
+                self.village_slots[slot] = None
+                self.free_slots.append(int(slot))
+                if self.log:
+                    self.log.village_removed(village.id)
+        pop.keep(alive)
+
+    def move_agents(self):
+        pop = self.population
+        x, y, energy, age = pop.x, pop.y, pop.energy, pop.age
+        if self.log:
+            old_x, old_y = x.copy(), y.copy()
+        self.move_positions()
+        energy -= settings.energy_loss
+        age += 1
+        if self.log:
+            moved = (x != old_x) | (y != old_y)
+            self.log.moved_many(pop.id[moved], (x - old_x)[moved], (y - old_y)[moved])
+
+    def move_positions(self):
+        pop = self.population
+        field = self.food_field()
+        move_cells(pop.x, pop.y, race_table.column("moves", pop.race), self.walkable, self.streams["move"].rng,
+                   field.array() if field else None)
+
+    def food_keys(self):
+        cells = self.food.cells
+        return np.fromiter((fy * self.width + fx for fx, fy in cells), dtype=np.int64, count=len(cells))
+
+    def feed_agents(self):
+        if not self.food.count:
+            return
+        pop = self.population
+        radius = int(settings.food_search_radius)
+        x, y, energy = pop.x, pop.y, pop.energy
+        field = self.food.field
+        cells = self.food_keys
+        if field:
+            hungry = field.hungry(cells, x, y, radius)
+        else:
+            hungry = np.flatnonzero(window_counts(cells(), x, y, radius, self.width, self.height))
+        for i in hungry:
+            if not self.food.count:
+                break
+            food = self.food.take_near(int(x[i]), int(y[i]), radius)
+            if food:
+                energy[i] = min(energy[i] + settings.energy_from_food, settings.max_energy)
+                if self.log:
+                    self.log.food_eaten(food.x, food.y)
+                self.food.release(food)
+
+    def breed_agents(self):
+        pop = self.population
+        x, y, race = pop.x, pop.y, pop.race
+        ready = self.breeders()
+        pop.energy[ready] -= settings.reproduction_cost
+        return x[ready].copy(), y[ready].copy(), race[ready].copy(), pop.village[ready].copy()
+
+    def breeders(self):
+        pop = self.population
+        x, y, race = pop.x, pop.y, pop.race
+        ready = ((pop.energy >= settings.reproduction_energy) &
+                 (pop.age < race_table.column("fertile_age", race)) &
+                 (pop.age > settings.min_reproduction_age))
+        ready &= self.streams["reproduce"].rng.random(pop.size) < settings.reproduction_chance
+        cells = y.astype(np.int64) * self.width + x
+        return crowded(ready, [cells[race == race_id] for race_id in range(len(Agent.RACES))],
+                       x, y, race, self.width, self.height)
+
+    def found_villages(self):
+        pop = self.population
+        builders = np.flatnonzero((self.streams["village"].rng.random(pop.size) < settings.village_build_chance) &
+                                  (pop.energy >= settings.village_energy_cost) & (pop.village < 0))
+        for i in builders:
+            x, y = int(pop.x[i]), int(pop.y[i])
+            if self.villages.too_close(x, y, settings.village_min_distance):
+                continue
+            village = Village(x, y, Agent.RACES[pop.race[i]])
+            self.villages.add(village)
+            self.register_village(village, int(pop.id[i]))
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.village_slots[slot] = village
+            else:
+                slot = len(self.village_slots)
+                self.village_slots.append(village)
+            pop.village[i] = slot
+            pop.energy[i] -= settings.village_build_cost
+
+    def resolve_fights(self):
+        pop = self.population
+        if pop.size < 2 or self.streams["fight"].random() >= settings.fight_chance:
+            return
+        self.cull(self.survivors(), "fight")
+
+    def survivors(self):
+        pop = self.population
+        cells = pop.y.astype(np.int64) * self.width + pop.x
+        return fight_survivors(cells, pop.race, race_table.column("strength", pop.race), self.streams["fight"].rng)
+
+    def occupied_chunks(self):
+        pop = self.population
+        columns = -(-self.width // CHUNK_SIZE)
+        keys = np.unique(pop.y // CHUNK_SIZE * columns + pop.x // CHUNK_SIZE)
+        return zip((keys % columns).tolist(), (keys // columns).tolist())
+
+    def count_races(self):
+        counts = np.bincount(self.population.race, minlength=len(Agent.RACES))
+        return {race: int(counts[i]) for i, race in enumerate(Agent.RACES)}
+
+    def agent_columns(self, village_index):
+        pop = self.population
+        slot_index = np.full(len(self.village_slots) + 1, -1, dtype=np.int32)
+        for slot, village in enumerate(self.village_slots):
+            if village is not None:
+                slot_index[slot] = village_index[village]
+        return [("agent_" + name, getattr(pop, name).copy()) for name in ArrayPopulation.FIELDS if name != "village"] + \
+            [("agent_village", slot_index[pop.village])]
+
+    def restore_agents(self, columns, villages):
+        self.walkable = self.terrain.walkable_array()
+        self.village_slots = list(villages)
+        pop = self.population
+        count = len(columns["agent_x"])
+        pop.reserve(count)
+        for name, dtype in ArrayPopulation.FIELDS.items():
+            if "agent_" + name in columns:
+                getattr(pop, "_" + name)[:count] = np.frombuffer(columns["agent_" + name], dtype=dtype)
+        pop.size = count
+
+    def agent_cells(self):
+        pop = self.population
+        return pop.x, pop.y, np.array(ArrayPopulation.RACE_COLORS, dtype=np.uint8)[pop.race]
+
+
+class SharedBlock(shared_memory.SharedMemory):
+    def close(self):
+        try:
+            super().close()
+        except BufferError:
+            pass
+
+
+class SharedArena:
+    def __init__(self):
+        self.blocks = {}
+
+    def array(self, name, count, dtype):
+        dtype = np.dtype(dtype)
+        block = self.blocks.get(name)
+        if block is None or block[0].size < count * dtype.itemsize or block[1] != dtype:
+            if block is not None:
+                self.retire(block[0])
+            block = (SharedBlock(create=True, size=max(1, count * dtype.itemsize)), dtype, count)
+        else:
+            block = (block[0], dtype, count)
+        self.blocks[name] = block
+        return np.frombuffer(block[0].buf, dtype, count)
+
+    def specs(self, names):
+        return {name: (self.blocks[name][0].name, self.blocks[name][1].str, self.blocks[name][2]) for name in names}
+
+    def retire(self, block):
+        block.close()
+        block.unlink()
+
+    def close(self):
+        for block, _, _ in self.blocks.values():
+            self.retire(block)
+        self.blocks.clear()
+
+
+class SharedPopulation(ArrayPopulation):
+    def __init__(self, capacity, arena):
+        self.arena = arena
+        super().__init__(capacity)
+
+    def allocate(self, name, dtype):
+        data = self.arena.array(name, self.capacity, dtype)
+        data[:] = 0
+        return data
+
+
+def tile_indices(arrays, params):
+    return arrays["order"][params["start"]:params["end"]]
+
+
+def tile_rng(params):
+    return np.random.default_rng([params["key"], params["tile"]])
+
+
+def tile_move(arrays, params):
+    idx = tile_indices(arrays, params)
+    if not len(idx):
+        return
+    walkable = arrays["walkable"].view(np.bool_).reshape(params["height"], params["width"])
+    x, y = arrays["x"][idx], arrays["y"][idx]
+    field = arrays["food_field"].reshape(walkable.shape) if "food_field" in arrays else None
+    move_cells(x, y, race_table.column("moves", arrays["race"][idx]), walkable, tile_rng(params), field)
+    arrays["x"][idx] = x
+    arrays["y"][idx] = y
+
+
+def take_stock(stock, x, y, radius, width):
+    left, right = max(0, x - radius), min(width, x + radius + 1)
+    for row in range((y - radius) * width, (y + radius + 1) * width, width):
+        for key in range(row + left, row + right):
+            if stock.get(key):
+                stock[key] -= 1
+                return key
+    return -1
+
+
+def tile_eat(arrays, params):
+    idx = tile_indices(arrays, params)
+    start, end = params["food_spans"][params["tile"]]
+    keys, counts, eaten = arrays["food"][start:end], arrays["food_count"][start:end], arrays["eaten"]
+    width, radius = params["width"], params["radius"]
+    x, y = arrays["x"][idx], arrays["y"][idx]
+    stock = dict(zip(keys.tolist(), counts.tolist()))
+    taken = np.full(len(idx), -1, dtype=np.int64)
+    if "food_clear" in arrays:
+        shape = params["height"], width
+        hungry = foragers(arrays["food_field"].reshape(shape), arrays["food_clear"].reshape(shape),
+                          lambda: keys, x, y, radius)
+    else:
+        hungry = np.flatnonzero(window_counts(keys, x, y, radius, width, params["height"]))
+    for i in hungry.tolist():
+        taken[i] = take_stock(stock, int(x[i]), int(y[i]), radius, width)
+    counts[:] = [stock[key] for key in keys.tolist()]
+    eaten[idx] = taken
+    fed = idx[taken >= 0]
+    energy = arrays["energy"]
+    energy[fed] = np.minimum(energy[fed] + settings.energy_from_food, settings.max_energy)
+
+
+def tile_breed(arrays, params):
+    idx = tile_indices(arrays, params)
+    width, height = params["width"], params["height"]
+    x, y, race = arrays["x"], arrays["y"], arrays["race"]
+    halo = arrays["order"][params["halo_start"]:params["halo_end"]]
+    cells = y[halo].astype(np.int64) * width + x[halo]
+    cells = [cells[race[halo] == race_id] for race_id in range(len(Agent.RACES))]
+    energy, age = arrays["energy"][idx], arrays["age"][idx]
+    ready = ((energy >= settings.reproduction_energy) &
+             (age < race_table.column("fertile_age", race[idx])) &
+             (age > settings.min_reproduction_age))
+    ready &= tile_rng(params).random(len(idx)) < settings.reproduction_chance
+    arrays["flag"][idx] = crowded(ready, cells, x[idx], y[idx], race[idx], width, height)
+
+
+def tile_fight(arrays, params):
+    idx = tile_indices(arrays, params)
+    cells = arrays["y"][idx].astype(np.int64) * params["width"] + arrays["x"][idx]
+    race = arrays["race"][idx]
+    arrays["flag"][idx] = fight_survivors(cells, race, race_table.column("strength", race), tile_rng(params))
+
+
+TILE_PHASES = {"move": tile_move, "eat": tile_eat, "breed": tile_breed, "fight": tile_fight}
+
+
+def tile_worker(conn):
+    blocks = {}
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        phase, specs, values, params = message
+        settings.__dict__.update(values)
+        race_table.refresh()
+        for key, (name, _, _) in specs.items():
+            if key not in blocks or blocks[key].name != name:
+                if key in blocks:
+                    blocks[key].close()
+                blocks[key] = SharedBlock(name=name)
+        arrays = {key: np.frombuffer(blocks[key].buf, dtype, count) for key, (_, dtype, count) in specs.items()}
+        try:
+            TILE_PHASES[phase](arrays, params)
+            conn.send(None)
+        except Exception as error:
+            conn.send(error)
+        del arrays
+    for block in blocks.values():
+        block.close()
+
+
+class ParallelWorld(ArrayWorld):
+    POPULATION = ("x", "y", "race", "energy", "age")
+
+    def __init__(self, seed=None, capacity=1024, generate=True, width=GRID_WIDTH, height=GRID_HEIGHT, workers=None):
+        self.arena = SharedArena()
+        self.workers = self.tiles = max(1, workers or os.cpu_count() or 1)
+        self.pool = None
+        super().__init__(seed, capacity, generate, width, height)
+
+    def setup_agents(self):
+        if not isinstance(self.terrain.walkable, memoryview):
+            walkable = self.arena.array("walkable", self.width * self.height, np.uint8)
+            walkable[:] = np.frombuffer(self.terrain.walkable, dtype=np.uint8)
+            self.terrain.walkable = memoryview(walkable)
+        super().setup_agents()
+        self.population = self.agents = SharedPopulation(self.capacity, self.arena)
+
+    def start_workers(self):
+        os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+        context = multiprocessing.get_context("spawn")
+        self.pool = []
+        for _ in range(self.workers):
+            parent, child = context.Pipe()
+            process = context.Process(target=tile_worker, args=(child,), daemon=True)
+            process.start()
+            self.pool.append((process, parent))
+
+    def close(self):
+        if self.pool:
+            for process, conn in self.pool:
+                conn.send(None)
+            for process, conn in self.pool:
+                process.join()
+                conn.close()
+        self.pool = None
+        self.arena.close()
+
+    def tile_edges(self):
+        return -(-np.arange(self.tiles + 1) * self.width // self.tiles)
+
+    def run_tiles(self, phase, stream, names, passes=None, halo=0, **params):
+        pop = self.population
+        order = np.argsort(pop.x, kind="stable")
+        xs = pop.x[order]
+        edges = self.tile_edges()
+        bounds = np.searchsorted(xs, edges)
+        halo_start, halo_end = np.searchsorted(xs, edges[:-1] - halo), np.searchsorted(xs, edges[1:] + halo)
+        self.arena.array("order", pop.size, np.int64)[:] = order
+        flag = self.arena.array("flag", pop.size, np.bool_)
+        names = ("order", "flag", "walkable") + names
+        specs = self.arena.specs(names)
+        params.update(width=self.width, height=self.height,
+                      key=self.streams[stream].randrange(0, 1 << 62) if stream else 0)
+        jobs = [dict(params, tile=t, start=int(bounds[t]), end=int(bounds[t + 1]),
+                     halo_start=int(halo_start[t]), halo_end=int(halo_end[t]), x0=int(edges[t]), x1=int(edges[t + 1]))
+                for t in range(self.tiles)]
+        if self.workers == 1:
+            arrays = {key: np.frombuffer(self.arena.blocks[key][0].buf, dtype, count)
+                      for key, (_, dtype, count) in specs.items()}
+            for tiles in passes or [range(self.tiles)]:
+                for t in tiles:
+                    TILE_PHASES[phase](arrays, jobs[t])
+            return flag
+        if self.pool is None:
+            self.start_workers()
+        values = vars(settings)
+        for tiles in passes or [range(self.tiles)]:
+            for start in range(0, len(tiles), self.workers):
+                batch = tiles[start:start + self.workers]
+                for (_, conn), t in zip(self.pool, batch):
+                    conn.send((phase, specs, values, jobs[t]))
+                for _, conn in self.pool[:len(batch)]:
+                    error = conn.recv()
+                    if error:
+                        raise error
+        return flag
+
+    def field_buffers(self):
+        return (self.arena.array("food_field", self.width * self.height, np.uint16),
+                self.arena.array("food_clear", self.width * self.height, np.bool_))
+
+    def move_positions(self):
+        self.run_tiles("move", "move", self.POPULATION + (("food_field",) if self.food_field() else ()))
+
+    def feed_agents(self):
+        if not self.food.count:
+            return
+        pop = self.population
+        width = self.width
+        radius = int(settings.food_search_radius)
+        cells = self.food.cells
+        keys = np.fromiter((fy * width + fx for fx, fy in cells), dtype=np.int64, count=len(cells))
+        counts = np.fromiter(map(len, cells.values()), dtype=np.int32, count=len(cells))
+        order = np.lexsort((keys, keys % width))
+        self.arena.array("food", len(keys), np.int64)[:] = keys[order]
+        self.arena.array("food_count", len(keys), np.int32)[:] = counts[order]
+        columns, edges = keys[order] % width, self.tile_edges()
+        spans = zip(np.searchsorted(columns, edges[:-1] - radius).tolist(),
+                    np.searchsorted(columns, edges[1:] + radius).tolist())
+        self.arena.array("eaten", pop.size, np.int64)
+        if self.tiles > 1 and width // self.tiles >= 2 * radius:
+            passes = [range(0, self.tiles, 2), range(1, self.tiles, 2)]
+        else:
+            passes = [[t] for t in range(self.tiles)]
+        field = self.food.field
+        names = self.POPULATION + ("food", "food_count", "eaten")
+        if field and radius <= field.reach:
+            names += ("food_field", "food_clear")
+        self.run_tiles("eat", None, names, passes, radius=radius, food_spans=list(spans))
+        eaten = self.arena.array("eaten", pop.size, np.int64)
+        for key in eaten[eaten >= 0].tolist():
+            food = self.food.take_near(key % width, key // width, 0)
+            if self.log:
+                self.log.food_eaten(food.x, food.y)
+            self.food.release(food)
+
+    def breeders(self):
+        return self.run_tiles("breed", "reproduce", self.POPULATION, halo=5).copy()
+
+    def survivors(self):
+        return self.run_tiles("fight", "fight", self.POPULATION).copy()
+
+
+SNAPSHOT_MAGIC = b"WBOX"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_PREFIX = struct.Struct("<4sII")
+
+
+def snapshot_chunks(world):
+    villages = list(world.villages)
+    village_index = {village: i for i, village in enumerate(villages)}
+    food = list(world.food)
+    hazards = world.hazards
+    chunks = sorted(world.terrain.chunks)
+    columns = [
+        ("terrain_chunk_x", array("i", [cx for cx, _ in chunks])),
+        ("terrain_chunk_y", array("i", [cy for _, cy in chunks])),
+        ("terrain_chunks", b"".join(world.terrain.chunks[key] for key in chunks)),
+        ("food_x", array("i", [f.x for f in food])),
+        ("food_y", array("i", [f.y for f in food])),
+        ("village_id", array("q", [v.id for v in villages])),
+        ("village_x", array("i", [v.x for v in villages])),
+        ("village_y", array("i", [v.y for v in villages])),
+        ("village_race", array("b", [Agent.RACES.index(v.race) for v in villages])),
+        ("village_population", array("i", [v.population for v in villages])),
+        ("village_level", array("b", [v.level for v in villages])),
+        ("hazard_x", array("i", b"".join(hazard.xs.tobytes() for hazard in hazards))),
+        ("hazard_y", array("i", b"".join(hazard.ys.tobytes() for hazard in hazards))),
+    ] + world.agent_columns(village_index)
+    directory, offset = [], 0
+    for name, data in columns:
+        view = memoryview(data)
+        directory.append({"name": name, "type": view.format,
+                          "offset": offset, "nbytes": view.nbytes})
+        offset += -(-view.nbytes // 8) * 8
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION,
+        "engine": ("parallel" if isinstance(world, ParallelWorld) else
+                   "arrays" if isinstance(world, ArrayWorld) else "objects"),
+        "workers": world.workers if isinstance(world, ParallelWorld) else 1,
+        "seed": world.seed,
+        "tick": world.tick,
+        "next_agent_id": world.next_agent_id,
+        "next_village_id": world.next_village_id,
+        "width": world.width,
+        "height": world.height,
+        "chunk_size": CHUNK_SIZE,
+        "settings": vars(settings),
+        "rng": world.rng_state(),
+        "stats": world.stats.state(),
+        "hazards": [{"kind": hazard.kind, "age": hazard.age, "count": len(hazard)} for hazard in hazards],
+        "columns": directory,
+    }).encode("utf-8")
+    chunks = [SNAPSHOT_PREFIX.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(header)), header]
+    chunks.append(bytes(-(SNAPSHOT_PREFIX.size + len(header)) % 8))
+    for name, data in columns:
+        view = memoryview(data).cast("B")
+        chunks.append(view)
+        chunks.append(bytes(-view.nbytes % 8))
+    return chunks
+
+
+def write_snapshot(path, chunks):
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    os.replace(temp_path, path)
+
+
+def save_snapshot(world, path):
+    write_snapshot(path, snapshot_chunks(world))
+
+
+def load_snapshot(path, use_mmap=True, engine=None, workers=None):
+    with open(path, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if use_mmap else f.read()
+    return restore_snapshot(memoryview(data), engine, path, workers)
+
+
+def restore_snapshot(view, engine=None, source="snapshot", workers=None):
+    magic, version, header_size = SNAPSHOT_PREFIX.unpack_from(view)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        raise ValueError(f"{source} není snapshot WorldBoxu verze {SNAPSHOT_VERSION}")
+    header = json.loads(bytes(view[SNAPSHOT_PREFIX.size:SNAPSHOT_PREFIX.size + header_size]))
+    base = SNAPSHOT_PREFIX.size + header_size
+    base += -base % 8
+    columns = {c["name"]: view[base + c["offset"]:base + c["offset"] + c["nbytes"]].cast(c["type"])
+               for c in header["columns"]}
+
+    if header["chunk_size"] != CHUNK_SIZE:
+        raise ValueError(f"{source} má chunky velikosti {header['chunk_size']}, očekáváno {CHUNK_SIZE}")
+    settings.__dict__.update(header["settings"])
+    engine = engine or header["engine"]
+    if engine == "parallel":
+        if header["engine"] == "parallel":
+            workers = workers or header.get("workers")
+        world = ParallelWorld(header["seed"], generate=False, width=header["width"], height=header["height"],
+                              workers=workers)
+    else:
+        world_class = ArrayWorld if engine == "arrays" else World
+        world = world_class(header["seed"], generate=False, width=header["width"], height=header["height"])
+    world.tick = header["tick"]
+    chunk_bytes = CHUNK_SIZE * CHUNK_SIZE
+    terrain = columns["terrain_chunks"]
+    for i, (cx, cy) in enumerate(zip(columns["terrain_chunk_x"], columns["terrain_chunk_y"])):
+        world.terrain.set_chunk(cx, cy, terrain[i * chunk_bytes:(i + 1) * chunk_bytes])
+    for x, y in zip(columns["food_x"], columns["food_y"]):
+        world.food.add(x, y)
+    villages = []
+    for i in range(len(columns["village_x"])):
+        village = Village(columns["village_x"][i], columns["village_y"][i], Agent.RACES[columns["village_race"][i]])
+        village.id = columns["village_id"][i]
+        village.population = columns["village_population"][i]
+        village.level = columns["village_level"][i]
+        world.villages.add(village)
+        villages.append(village)
+    world.restore_agents(columns, villages)
+    offset = 0
+    for entry in header.get("hazards", []):
+        part = slice(offset, offset + entry["count"])
+        world.hazards.append(Hazard(entry["kind"], columns["hazard_x"][part], columns["hazard_y"][part], entry["age"]))
+        offset += entry["count"]
+    world.stats.restore(header.get("stats", {}), world.count_races())
+    world.next_agent_id = header["next_agent_id"]
+    world.next_village_id = header["next_village_id"]
+    world.restore_rng(header["rng"])
+    return world
+
+
+class EventLog:
+    MAGIC = b"WBEV"
+    VERSION = 1
+    PREFIX = struct.Struct("<4sI")
+    RECORD = struct.Struct("<BIQ")
+    FRAME, KEYFRAME = 1, 2
+    BIRTH, DEATH, MOVES, FOOD_ADD, FOOD_EAT, VILLAGE_FOUND, VILLAGE_REMOVE, METEOR, LIGHTNING, TERRAIN = range(1, 11)
+    EVENTS = {
+        BIRTH: struct.Struct("<BqHHbq"),
+        DEATH: struct.Struct("<BqB"),
+        MOVES: struct.Struct("<BI"),
+        FOOD_ADD: struct.Struct("<BHH"),
+        FOOD_EAT: struct.Struct("<BHH"),
+        VILLAGE_FOUND: struct.Struct("<BqHHbq"),
+        VILLAGE_REMOVE: struct.Struct("<Bq"),
+        METEOR: struct.Struct("<BHHH"),
+        LIGHTNING: struct.Struct("<BHH"),
+        TERRAIN: struct.Struct("<BIB"),
+    }
+    CAUSES = ["age", "starvation", "fight", "meteor", "lightning", "fire", "plague", "flood"]
+
+    def __init__(self, path, keyframe_every=1000, batch_bytes=1 << 20):
+        self.file = open(path, "wb")
+        self.file.write(self.PREFIX.pack(self.MAGIC, self.VERSION))
+        self.keyframe_every = keyframe_every
+        self.batch_bytes = batch_bytes
+        self.frame = bytearray()
+        self.pending = bytearray()
+        self.move_ids = array("q")
+        self.move_dx = array("h")
+        self.move_dy = array("h")
+
+    def attach(self, world):
+        world.log = self
+        self.keyframe(world)
+
+    def birth(self, agent_id, x, y, race_id, village_id):
+        self.frame += self.EVENTS[self.BIRTH].pack(self.BIRTH, agent_id, x, y, race_id, village_id)
+
+    def death(self, agent_id, cause):
+        self.frame += self.EVENTS[self.DEATH].pack(self.DEATH, agent_id, self.CAUSES.index(cause))
+
+    def moved(self, agent_id, dx, dy):
+        self.move_ids.append(agent_id)
+        self.move_dx.append(dx)
+        self.move_dy.append(dy)
+
+    def moved_many(self, ids, dxs, dys):
+        self.move_ids.frombytes(np.asarray(ids, dtype=np.int64).tobytes())
+        self.move_dx.frombytes(np.asarray(dxs, dtype=np.int16).tobytes())
+        self.move_dy.frombytes(np.asarray(dys, dtype=np.int16).tobytes())
+
+    def food_added(self, x, y):
+        self.frame += self.EVENTS[self.FOOD_ADD].pack(self.FOOD_ADD, x, y)
+
+    def food_eaten(self, x, y):
+        self.frame += self.EVENTS[self.FOOD_EAT].pack(self.FOOD_EAT, x, y)
+
+    def village_founded(self, village_id, x, y, race_id, founder_id):
+        self.frame += self.EVENTS[self.VILLAGE_FOUND].pack(self.VILLAGE_FOUND, village_id, x, y, race_id, founder_id)
+
+    def village_removed(self, village_id):
+        self.frame += self.EVENTS[self.VILLAGE_REMOVE].pack(self.VILLAGE_REMOVE, village_id)
+
+    def meteor(self, x, y, radius):
+        self.frame += self.EVENTS[self.METEOR].pack(self.METEOR, x, y, radius)
+
+    def lightning(self, x, y):
+        self.frame += self.EVENTS[self.LIGHTNING].pack(self.LIGHTNING, x, y)
+
+    def terrain(self, xs, ys, terrain_type):
+        self.frame += self.EVENTS[self.TERRAIN].pack(self.TERRAIN, len(xs), terrain_type)
+        self.frame += array("H", map(int, xs)).tobytes() + array("H", map(int, ys)).tobytes()
+
+    def end_tick(self, world):
+        if self.move_ids:
+            self.frame += self.EVENTS[self.MOVES].pack(self.MOVES, len(self.move_ids))
+            self.frame += self.move_ids.tobytes() + self.move_dx.tobytes() + self.move_dy.tobytes()
+            del self.move_ids[:], self.move_dx[:], self.move_dy[:]
+        self.pending += self.RECORD.pack(self.FRAME, world.tick, len(self.frame))
+        self.pending += self.frame
+        self.frame.clear()
+        if self.keyframe_every and world.tick % self.keyframe_every == 0:
+            self.keyframe(world)
+        if len(self.pending) >= self.batch_bytes:
+            self.flush()
+
+    def keyframe(self, world):
+        data = b"".join(snapshot_chunks(world))
+        self.pending += self.RECORD.pack(self.KEYFRAME, world.tick, len(data))
+        self.pending += data
+
+    def flush(self):
+        self.file.write(self.pending)
+        self.pending.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class Replay:
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        magic, version = EventLog.PREFIX.unpack_from(self.data)
+        if magic != EventLog.MAGIC or version != EventLog.VERSION:
+            raise ValueError(f"{path} není záznam WorldBoxu verze {EventLog.VERSION}")
+        self.keyframes = []
+        self.frames = {}
+        position = EventLog.PREFIX.size
+        while position + EventLog.RECORD.size <= len(self.data):
+            kind, tick, size = EventLog.RECORD.unpack_from(self.data, position)
+            start = position + EventLog.RECORD.size
+            if start + size > len(self.data):
+                break
+            if kind == EventLog.KEYFRAME:
+                self.keyframes.append((tick, start, size))
+            else:
+                self.frames[tick] = (start, size)
+            position = start + size
+        if not self.keyframes:
+            raise ValueError(f"{path} neobsahuje žádný keyframe")
+        self.first_tick = self.keyframes[0][0]
+        self.last_tick = max([self.first_tick] + list(self.frames))
+        self.world = None
+        self.seek(self.first_tick)
+
+    def seek(self, tick):
+        tick = max(self.first_tick, min(self.last_tick, tick))
+        keyframe = max((k for k in self.keyframes if k[0] <= tick), key=lambda k: k[0])
+        if self.world is None or tick < self.world.tick or keyframe[0] > self.world.tick:
+            self.restore(keyframe)
+        while self.world.tick < tick:
+            start, size = self.frames[self.world.tick + 1]
+            self.apply(self.data[start:start + size])
+            self.world.tick += 1
+        return self.world
+
+    def restore(self, keyframe):
+        tick, start, size = keyframe
+        self.world = restore_snapshot(self.data[start:start + size], engine="objects", source="keyframe")
+        self.agents_by_id = {agent.id: agent for agent in self.world.agents}
+        self.villages_by_id = {village.id: village for village in self.world.villages}
+
+    def apply(self, payload):
+        world = self.world
+        width, height = world.width, world.height
+        events = EventLog.EVENTS
+        position = 0
+        while position < len(payload):
+            kind = payload[position]
+            fields = events[kind].unpack_from(payload, position)
+            position += events[kind].size
+            if kind == EventLog.MOVES:
+                count = fields[1]
+                ids = payload[position:position + 8 * count].cast("q")
+                position += 8 * count
+                dxs = payload[position:position + 2 * count].cast("h")
+                position += 2 * count
+                dys = payload[position:position + 2 * count].cast("h")
+                position += 2 * count
+                for agent_id, dx, dy in zip(ids, dxs, dys):
+                    agent = self.agents_by_id.get(agent_id)
+                    if agent:
+                        old_x, old_y = agent.x, agent.y
+                        agent.x = (old_x + dx) % width
+                        agent.y = (old_y + dy) % height
+                        world.agent_grid.move(agent, old_x, old_y)
+            elif kind == EventLog.BIRTH:
+                _, agent_id, x, y, race_id, village_id = fields
+                agent = Agent(x, y, Agent.RACES[race_id])
+                agent.id = agent_id
+                agent.village = self.villages_by_id.get(village_id)
+                if agent.village:
+                    agent.village.join()
+                world.insert_agent(agent)
+                world.stats.born(agent.race)
+                self.agents_by_id[agent_id] = agent
+            elif kind == EventLog.DEATH:
+                agent = self.agents_by_id.pop(fields[1], None)
+                if agent:
+                    world.remove_agent(agent, EventLog.CAUSES[fields[2]])
+            elif kind == EventLog.FOOD_ADD:
+                world.food.add(fields[1], fields[2])
+            elif kind == EventLog.FOOD_EAT:
+                world.food.take_near(fields[1], fields[2], 0)
+            elif kind == EventLog.VILLAGE_FOUND:
+                _, village_id, x, y, race_id, founder_id = fields
+                village = Village(x, y, Agent.RACES[race_id])
+                village.id = village_id
+                world.villages.add(village)
+                self.villages_by_id[village_id] = village
+                founder = self.agents_by_id.get(founder_id)
+                if founder:
+                    founder.village = village
+            elif kind == EventLog.VILLAGE_REMOVE:
+                village = self.villages_by_id.pop(fields[1], None)
+                if village in world.villages:
+                    world.villages.remove(village)
+            elif kind == EventLog.METEOR:
+                Disaster.scorch(fields[1], fields[2], fields[3], world.terrain)
+            elif kind == EventLog.TERRAIN:
+                count = fields[1]
+                xs = payload[position:position + 2 * count].cast("H")
+                position += 2 * count
+                ys = payload[position:position + 2 * count].cast("H")
+                position += 2 * count
+                world.terrain.paint(xs, ys, fields[2])
+
+
+class Checkpointer:
+    def __init__(self, path, every):
+        self.path = path
+        self.every = every
+        self.writer = None
+
+    def maybe_save(self, world):
+        if self.every and world.tick % self.every == 0:
+            self.save(world)
+
+    def save(self, world):
+        if self.writer and self.writer.is_alive():
+            return False
+        chunks = snapshot_chunks(world)
+        self.writer = threading.Thread(target=write_snapshot, args=(self.path, chunks), daemon=True)
+        self.writer.start()
+        return True
+
+    def wait(self):
+        if self.writer:
+            self.writer.join()
+
+
+class Telemetry:
+    def __init__(self, path, every=100, batch_rows=1024):
+        self.jsonl = path.endswith(".jsonl")
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.every = every
+        self.batch_rows = batch_rows
+        self.pending = []
+        self.columns = (["tick", "agents"] + Agent.RACES + ["births"] +
+                        ["deaths_" + cause for cause in EventLog.CAUSES] + ["villages", "food"])
+        if not self.jsonl:
+            self.file.write(",".join(self.columns) + "\n")
+
+    def attach(self, world):
+        world.telemetry = self
+        self.record(world)
+
+    def end_tick(self, world):
+        if world.tick % self.every == 0:
+            self.record(world)
+
+    def record(self, world):
+        stats = world.stats
+        population = stats.population
+        row = ([world.tick, sum(population.values())] + [population[race] for race in Agent.RACES] +
+               [sum(stats.births.values())] + [stats.deaths[cause] for cause in EventLog.CAUSES] +
+               [len(world.villages), len(world.food)])
+        if self.jsonl:
+            self.pending.append(json.dumps(dict(zip(self.columns, row))))
+        else:
+            self.pending.append(",".join(map(str, row)))
+        if len(self.pending) >= self.batch_rows:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.file.write("\n".join(self.pending) + "\n")
+            self.pending.clear()
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def create_world(seed=None, array_mode=False, load_path=None, width=GRID_WIDTH, height=GRID_HEIGHT, workers=0):
+    if load_path:
+        world = load_snapshot(load_path, engine="parallel" if workers else "arrays" if array_mode else None,
+                              workers=workers or None)
+    elif workers:
+        world = ParallelWorld(seed, width=width, height=height, workers=workers)
+    elif array_mode:
+        world = ArrayWorld(seed, width=width, height=height)
+    else:
+        world = World(seed, width=width, height=height)
+    gc.collect()
+    gc.freeze()
+    return world
+
+
+def run_headless(ticks, seed=None, report_every=0, array_mode=False, profile_out=None, load_path=None,
+                 checkpointer=None, event_log=None, width=GRID_WIDTH, height=GRID_HEIGHT, telemetry=None, workers=0):
+    world = create_world(seed, array_mode, load_path, width, height, workers)
+    try:
+        world.profiler.enabled = profile_out is not None
+        if event_log:
+            event_log.attach(world)
+        if telemetry:
+            telemetry.attach(world)
+        start = time.perf_counter()
+        for done in range(ticks):
+            world.step()
+            if checkpointer:
+                checkpointer.maybe_save(world)
+            if report_every and (done + 1) % report_every == 0:
+                print(f"tick {world.tick}: agenti {len(world.agents)}, vesnice {len(world.villages)}, jídlo {len(world.food)}")
+        elapsed = time.perf_counter() - start
+        print(f"Ticků: {world.tick}, čas: {elapsed:.2f} s, {ticks / elapsed if elapsed else 0:.1f} ticků/s")
+        print_summary(world)
+        if event_log:
+            event_log.close()
+        if telemetry:
+            telemetry.close()
+        if profile_out:
+            world.profiler.dump(profile_out, tick=world.tick, agents=len(world.agents))
+        if checkpointer:
+            checkpointer.wait()
+    finally:
+        world.close()
+    return world
+
+
+def print_summary(world):
+    for race, count in world.race_counts().items():
+        print(f"{race}: {count}")
+    print(f"Celkem: {len(world.agents)}")
+    print(f"Vesnice: {len(world.villages)}")
+    print(f"Jídlo: {len(world.food)}")
+
+
+def replay_headless(path, tick):
+    start = time.perf_counter()
+    replay = Replay(path)
+    world = replay.seek(tick)
+    elapsed = time.perf_counter() - start
+    print(f"Záznam: ticky {replay.first_tick}-{replay.last_tick}, keyframů {len(replay.keyframes)}")
+    print(f"Tick: {world.tick}, čas: {elapsed:.2f} s")
+    print_summary(world)
+    return world
+
+
+def main(seed=None, array_mode=False, rect_render=False, profile_out=None, load_path=None, checkpointer=None,
+         event_log=None, replay=None, width=GRID_WIDTH, height=GRID_HEIGHT, speed=1, render_every=1, telemetry=None,
+         workers=0):
     pygame.init()
     screen = pygame.display.set_mode((WIDTH, HEIGHT))
     pygame.display.set_caption("WorldBox Simulátor s Menu")
     clock = pygame.time.Clock()
     font = pygame.font.SysFont(None, 24)
 
-    terrain = Terrain()
-    agents = []
-    food = []
-    villages = []
+    world = replay.world if replay else create_world(seed, array_mode, load_path, width, height, workers)
+    try:
+        if event_log:
+            event_log.attach(world)
+        if telemetry:
+            telemetry.attach(world)
+        replay_speed = 1
+        replay_direction = 1
+        checkpointer = checkpointer or Checkpointer("worldbox.snap", 0)
+        terrain = world.terrain
+        if np is not None and not rect_render:
+            cell_view, terrain_view = CellRenderer(terrain), None
+        else:
+            cell_view, terrain_view = None, TerrainSurface(terrain)
+        camera = Camera(world.width, world.height)
+        dragging_view = False
+        previous_rects = []
+        full_redraw = True
+        profiler = world.profiler
+        profile_out = profile_out or "worldbox_profile.json"
+        show_profile = profiler.enabled = False
 
-    races_positions = [(Agent.HUMAN, 5, 5), (Agent.ELF, WIDTH // CELL_SIZE - 6, 5),
-                       (Agent.DWARF, 5, HEIGHT // CELL_SIZE - 6),
-                       (Agent.ORC, WIDTH // CELL_SIZE - 6, HEIGHT // CELL_SIZE - 6)]
-
-    for race, base_x, base_y in races_positions:
-        for _ in range(12):
-            x = base_x + random.randint(-3, 3)
-            y = base_y + random.randint(-3, 3)
-            x = max(0, min(WIDTH // CELL_SIZE - 1, x))
-            y = max(0, min(HEIGHT // CELL_SIZE - 1, y))
-            if terrain.is_walkable(x, y):
-                agents.append(Agent(x, y, race))
-
-    for _ in range(int(settings.initial_food)):
-        x = random.randint(0, WIDTH // CELL_SIZE - 1)
-        y = random.randint(0, HEIGHT // CELL_SIZE - 1)
-        if terrain.is_walkable(x, y):
-            food.append(Food(x, y))
-
-    running = True
-    paused = False
-    selected_tool = None
-    show_menu = False
-
-    menu_x = 50
-    menu_y = 100
-    slider_width = 300
-    slider_height = 20
-    slider_spacing = 50
-
-    sliders = [
-        Slider(menu_x, menu_y, slider_width, slider_height, 20, 200, settings.initial_energy, "Počáteční energie", 5),
-        Slider(menu_x, menu_y + slider_spacing, slider_width, slider_height, 10, 100, settings.energy_from_food,
-               "Energie z jídla", 5),
-        Slider(menu_x, menu_y + slider_spacing * 2, slider_width, slider_height, 0.5, 5.0, settings.energy_loss,
-               "Úbytek energie", 0.1),
-        Slider(menu_x, menu_y + slider_spacing * 3, slider_width, slider_height, 0.01, 0.3,
-               settings.reproduction_chance, "Šance rozmnožení", 0.01),
-        Slider(menu_x, menu_y + slider_spacing * 4, slider_width, slider_height, 0.0, 0.5, settings.fight_death_chance,
-               "Smrtelnost bojů", 0.05),
-        Slider(menu_x, menu_y + slider_spacing * 5, slider_width, slider_height, 0.1, 2.0, settings.food_spawn_chance,
-               "Rychlost jídla", 0.1),
-        Slider(menu_x + 400, menu_y, slider_width, slider_height, 200, 1000, settings.human_max_age, "Human věk", 50),
-        Slider(menu_x + 400, menu_y + slider_spacing, slider_width, slider_height, 300, 1500, settings.elf_max_age,
-               "Elf věk", 50),
-        Slider(menu_x + 400, menu_y + slider_spacing * 2, slider_width, slider_height, 200, 1200,
-               settings.dwarf_max_age, "Dwarf věk", 50),
-        Slider(menu_x + 400, menu_y + slider_spacing * 3, slider_width, slider_height, 100, 800, settings.orc_max_age,
-               "Orc věk", 50),
-        Slider(menu_x + 400, menu_y + slider_spacing * 4, slider_width, slider_height, 1, 15, settings.human_strength,
-               "Human síla", 1),
-        Slider(menu_x + 400, menu_y + slider_spacing * 5, slider_width, slider_height, 1, 15, settings.elf_strength,
-               "Elf síla", 1),
-        Slider(menu_x + 800, menu_y, slider_width, slider_height, 1, 15, settings.dwarf_strength, "Dwarf síla", 1),
-        Slider(menu_x + 800, menu_y + slider_spacing, slider_width, slider_height, 1, 15, settings.orc_strength,
-               "Orc síla", 1),
-        Slider(menu_x + 800, menu_y + slider_spacing * 2, slider_width, slider_height, 0.5, 3.0, settings.human_speed,
-               "Human rychlost", 0.1),
-        Slider(menu_x + 800, menu_y + slider_spacing * 3, slider_width, slider_height, 0.5, 3.0, settings.elf_speed,
-               "Elf rychlost", 0.1),
-        Slider(menu_x + 800, menu_y + slider_spacing * 4, slider_width, slider_height, 0.5, 3.0, settings.dwarf_speed,
-               "Dwarf rychlost", 0.1),
-        Slider(menu_x + 800, menu_y + slider_spacing * 5, slider_width, slider_height, 0.5, 3.0, settings.orc_speed,
-               "Orc rychlost", 0.1),
-    ]
-
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                running = False
-            if show_menu:
-                for slider in sliders:
-                    slider.handle_event(event)
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_SPACE:
-                    paused = not paused
-                elif event.key == pygame.K_TAB:
-                    show_menu = not show_menu
-                elif event.key == pygame.K_1:
-                    selected_tool = "add_human"
-                elif event.key == pygame.K_2:
-                    selected_tool = "add_elf"
-                elif event.key == pygame.K_3:
-                    selected_tool = "add_dwarf"
-                elif event.key == pygame.K_4:
-                    selected_tool = "add_orc"
-                elif event.key == pygame.K_m:
-                    selected_tool = "meteor"
-                elif event.key == pygame.K_l:
-                    selected_tool = "lightning"
-                elif event.key == pygame.K_f:
-                    selected_tool = "food"
-                elif event.key == pygame.K_ESCAPE:
-                    selected_tool = None
-            elif event.type == pygame.MOUSEBUTTONDOWN and not show_menu:
-                mouse_x, mouse_y = pygame.mouse.get_pos()
-                grid_x = mouse_x // CELL_SIZE
-                grid_y = mouse_y // CELL_SIZE
-                if selected_tool and terrain.is_walkable(grid_x, grid_y):
-                    if selected_tool == "add_human":
-                        agents.append(Agent(grid_x, grid_y, Agent.HUMAN))
-                    elif selected_tool == "add_elf":
-                        agents.append(Agent(grid_x, grid_y, Agent.ELF))
-                    elif selected_tool == "add_dwarf":
-                        agents.append(Agent(grid_x, grid_y, Agent.DWARF))
-                    elif selected_tool == "add_orc":
-                        agents.append(Agent(grid_x, grid_y, Agent.ORC))
-                    elif selected_tool == "meteor":
-                        Disaster.meteor_strike(grid_x, grid_y, agents, terrain)
-                    elif selected_tool == "lightning":
-                        Disaster.lightning_strike(grid_x, grid_y, agents)
-                    elif selected_tool == "food":
-                        food.append(Food(grid_x, grid_y))
-
-        settings.initial_energy = sliders[0].value
-        settings.energy_from_food = sliders[1].value
-        settings.energy_loss = sliders[2].value
-        settings.reproduction_chance = sliders[3].value
-        settings.fight_death_chance = sliders[4].value
-        settings.food_spawn_chance = sliders[5].value
-        settings.human_max_age = sliders[6].value
-        settings.elf_max_age = sliders[7].value
-        settings.dwarf_max_age = sliders[8].value
-        settings.orc_max_age = sliders[9].value
-        settings.human_strength = sliders[10].value
-        settings.elf_strength = sliders[11].value
-        settings.dwarf_strength = sliders[12].value
-        settings.orc_strength = sliders[13].value
-        settings.human_speed = sliders[14].value
-        settings.elf_speed = sliders[15].value
-        settings.dwarf_speed = sliders[16].value
-        settings.orc_speed = sliders[17].value
-
-        if not paused and not show_menu:
-            for agent in agents[:]:
-                agent.move(terrain)
-                agent.eat(food)
-                agent.reproduce(agents, terrain)
-                if random.random() < settings.village_build_chance:
-                    agent.build_village(villages, terrain)
-                if agent.energy <= 0 or agent.age >= agent.max_age:
-                    agents.remove(agent)
-                    if agent.village:
-                        agent.village.population -= 1
-            if random.random() < settings.fight_chance:
-                for i, agent1 in enumerate(agents[:]):
-                    for agent2 in agents[i + 1:]:
-                        if agent1.x == agent2.x and agent1.y == agent2.y:
-                            loser = agent1.fight(agent2)
-                            if loser and loser in agents:
-                                agents.remove(loser)
-            if len(food) < settings.max_food and random.random() < settings.food_spawn_chance:
-                x = random.randint(0, WIDTH // CELL_SIZE - 1)
-                y = random.randint(0, HEIGHT // CELL_SIZE - 1)
-                if terrain.is_walkable(x, y):
-                    food.append(Food(x, y))
-            for village in villages[:]:
-                village.population = sum(1 for a in agents if a.village == village)
-                if village.population == 0:
-                    villages.remove(village)
+        running = True
+        paused = False
+        selected_tool = None
+        show_menu = False
+        backlog = 0.0
+        frame_seconds = 0.0
+        frame_count = 0
+        rate_tick, rate_time, tick_rate = world.tick, time.perf_counter(), 0.0
+
+        menu_x = 50
+        menu_y = 100
+        slider_width = 300
+        slider_height = 20
+        slider_spacing = 50
+
+        sliders = [
+            Slider(menu_x, menu_y, slider_width, slider_height, 20, 200, "initial_energy", "Počáteční energie", 5),
+            Slider(menu_x, menu_y + slider_spacing, slider_width, slider_height, 10, 100, "energy_from_food",
+                   "Energie z jídla", 5),
+            Slider(menu_x, menu_y + slider_spacing * 2, slider_width, slider_height, 0.5, 5.0, "energy_loss",
+                   "Úbytek energie", 0.1),
+            Slider(menu_x, menu_y + slider_spacing * 3, slider_width, slider_height, 0.01, 0.3,
+                   "reproduction_chance", "Šance rozmnožení", 0.01),
+            Slider(menu_x, menu_y + slider_spacing * 4, slider_width, slider_height, 0.0, 0.5, "fight_death_chance",
+                   "Smrtelnost bojů", 0.05),
+            Slider(menu_x, menu_y + slider_spacing * 5, slider_width, slider_height, 0.1, 2.0, "food_spawn_chance",
+                   "Rychlost jídla", 0.1),
+            Slider(menu_x + 400, menu_y, slider_width, slider_height, 200, 1000, "human_max_age", "Human věk", 50),
+            Slider(menu_x + 400, menu_y + slider_spacing, slider_width, slider_height, 300, 1500, "elf_max_age",
+                   "Elf věk", 50),
+            Slider(menu_x + 400, menu_y + slider_spacing * 2, slider_width, slider_height, 200, 1200,
+                   "dwarf_max_age", "Dwarf věk", 50),
+            Slider(menu_x + 400, menu_y + slider_spacing * 3, slider_width, slider_height, 100, 800, "orc_max_age",
+                   "Orc věk", 50),
+            Slider(menu_x + 400, menu_y + slider_spacing * 4, slider_width, slider_height, 1, 15, "human_strength",
+                   "Human síla", 1),
+            Slider(menu_x + 400, menu_y + slider_spacing * 5, slider_width, slider_height, 1, 15, "elf_strength",
+                   "Elf síla", 1),
+            Slider(menu_x + 800, menu_y, slider_width, slider_height, 1, 15, "dwarf_strength", "Dwarf síla", 1),
+            Slider(menu_x + 800, menu_y + slider_spacing, slider_width, slider_height, 1, 15, "orc_strength",
+                   "Orc síla", 1),
+            Slider(menu_x + 800, menu_y + slider_spacing * 2, slider_width, slider_height, 0.5, 3.0, "human_speed",
+                   "Human rychlost", 0.1),
+            Slider(menu_x + 800, menu_y + slider_spacing * 3, slider_width, slider_height, 0.5, 3.0, "elf_speed",
+                   "Elf rychlost", 0.1),
+            Slider(menu_x + 800, menu_y + slider_spacing * 4, slider_width, slider_height, 0.5, 3.0, "dwarf_speed",
+                   "Dwarf rychlost", 0.1),
+            Slider(menu_x + 800, menu_y + slider_spacing * 5, slider_width, slider_height, 0.5, 3.0, "orc_speed",
+                   "Orc rychlost", 0.1),
+        ]
+
+        while running:
+            profiler.start("frame")
+            view_state = camera.state()
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    running = False
+                if show_menu:
+                    for slider in sliders:
+                        if slider.handle_event(event):
+                            race_table.refresh()
+                if event.type == pygame.KEYDOWN:
+                    if event.key == pygame.K_SPACE:
+                        paused = not paused
+                    elif event.key == pygame.K_TAB:
+                        show_menu = not show_menu
+                        full_redraw = True
+                    elif event.key == pygame.K_1:
+                        selected_tool = "add_human"
+                    elif event.key == pygame.K_2:
+                        selected_tool = "add_elf"
+                    elif event.key == pygame.K_3:
+                        selected_tool = "add_dwarf"
+                    elif event.key == pygame.K_4:
+                        selected_tool = "add_orc"
+                    elif event.key == pygame.K_m:
+                        selected_tool = "meteor"
+                    elif event.key == pygame.K_l:
+                        selected_tool = "lightning"
+                    elif event.key == pygame.K_b:
+                        selected_tool = "fire"
+                    elif event.key == pygame.K_n:
+                        selected_tool = "plague"
+                    elif event.key == pygame.K_v:
+                        selected_tool = "flood"
+                    elif event.key == pygame.K_g:
+                        settings.foraging = not settings.foraging
+                    elif event.key == pygame.K_f:
+                        selected_tool = "food"
+                    elif event.key == pygame.K_p:
+                        show_profile = profiler.enabled = not show_profile
+                    elif event.key == pygame.K_o:
+                        profiler.dump(profile_out, tick=world.tick, agents=len(world.agents))
+                    elif event.key == pygame.K_F5:
+                        checkpointer.save(world)
+                    elif event.key in (pygame.K_F1, pygame.K_F2, pygame.K_F3, pygame.K_F4):
+                        speed = SPEEDS[[pygame.K_F1, pygame.K_F2, pygame.K_F3, pygame.K_F4].index(event.key)]
+                        backlog = 0.0
+                    elif event.key == pygame.K_r:
+                        render_every = next((k for k in RENDER_EVERY if k > render_every), RENDER_EVERY[0])
+                    elif replay and event.key == pygame.K_RIGHT:
+                        replay_direction = 1
+                    elif replay and event.key == pygame.K_LEFT:
+                        replay_direction = -1
+                    elif replay and event.key == pygame.K_UP:
+                        replay_speed = min(replay_speed * 10, 10000)
+                    elif replay and event.key == pygame.K_DOWN:
+                        replay_speed = max(1, replay_speed // 10)
+                    elif replay and event.key == pygame.K_HOME:
+                        replay.seek(replay.first_tick)
+                    elif event.key == pygame.K_ESCAPE:
+                        selected_tool = None
+                elif event.type == pygame.MOUSEWHEEL and not show_menu:
+                    camera.zoom_at(event.y * max(1, camera.zoom // 5), *pygame.mouse.get_pos())
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 3 and not show_menu:
+                    dragging_view = True
+                elif event.type == pygame.MOUSEBUTTONUP and event.button == 3:
+                    dragging_view = False
+                elif event.type == pygame.MOUSEMOTION and dragging_view:
+                    camera.pan(-event.rel[0], -event.rel[1])
+                elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1 and not show_menu and not replay:
+                    grid_x, grid_y = camera.to_cell(*pygame.mouse.get_pos())
+                    if selected_tool and terrain.is_walkable(grid_x, grid_y):
+                        if selected_tool == "add_human":
+                            world.add_agent(grid_x, grid_y, Agent.HUMAN)
+                        elif selected_tool == "add_elf":
+                            world.add_agent(grid_x, grid_y, Agent.ELF)
+                        elif selected_tool == "add_dwarf":
+                            world.add_agent(grid_x, grid_y, Agent.DWARF)
+                        elif selected_tool == "add_orc":
+                            world.add_agent(grid_x, grid_y, Agent.ORC)
+                        elif selected_tool in Disaster.KINDS:
+                            world.disaster(selected_tool, grid_x, grid_y)
+                        elif selected_tool == "food":
+                            world.add_food(grid_x, grid_y)
+
+            if not show_menu:
+                keys = pygame.key.get_pressed()
+                camera.pan((keys[pygame.K_d] - keys[pygame.K_a]) * 20, (keys[pygame.K_s] - keys[pygame.K_w]) * 20)
+            if not paused and not show_menu:
+                if replay:
+                    replay.seek(world.tick + replay_direction * replay_speed)
+                else:
+                    deadline = time.perf_counter() + 1 / (FPS or TICK_RATE)
+                    if speed is None:
+                        while time.perf_counter() < deadline:
+                            world.step()
+                            checkpointer.maybe_save(world)
+                    else:
+                        backlog = min(backlog + frame_seconds * TICK_RATE * speed, 2.0 * speed)
+                        while backlog >= 1 and time.perf_counter() < deadline:
+                            world.step()
+                            checkpointer.maybe_save(world)
+                            backlog -= 1
+            if replay and replay.world is not world:
+                world = replay.world
+                terrain = world.terrain
+                if cell_view:
+                    cell_view = CellRenderer(terrain)
                 else:
-                    village.grow()
-            if random.random() < settings.disaster_chance:
-                x = random.randint(0, WIDTH // CELL_SIZE - 1)
-                y = random.randint(0, HEIGHT // CELL_SIZE - 1)
-                if random.random() < 0.5:
-                    Disaster.meteor_strike(x, y, agents, terrain)
+                    terrain_view = TerrainSurface(terrain)
+                world.profiler = profiler
+                full_redraw = True
+            if camera.state() != view_state:
+                full_redraw = True
+            now = time.perf_counter()
+            if now - rate_time >= 1.0:
+                tick_rate = (world.tick - rate_tick) / (now - rate_time)
+                rate_tick, rate_time = world.tick, now
+
+            render_frame = show_menu or full_redraw or frame_count % render_every == 0
+            frame_count += 1
+            drawn = []
+            profiler.start("render")
+            if render_frame and not show_menu:
+                profiler.start("render.world")
+                screen.fill(BLACK)
+                x0, y0, x1, y1 = camera.visible()
+                if cell_view:
+                    cell_view.refresh()
+                    terrain_rects = [cell_view.draw(screen, world, camera)]
                 else:
-                    Disaster.lightning_strike(x, y, agents)
-
-        screen.fill(BLACK)
-
-        if not show_menu:
-            for y in range(len(terrain.grid)):
-                for x in range(len(terrain.grid[0])):
-                    color = terrain.get_color(terrain.grid[y][x])
-                    pygame.draw.rect(screen, color, (x * CELL_SIZE, y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-            for f in food:
-                pygame.draw.rect(screen, YELLOW, (f.x * CELL_SIZE, f.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-            for v in villages:
-                size = v.level * 2
-                village_color = ORANGE if v.race == Agent.HUMAN else (
-                    GREEN if v.race == Agent.ELF else (BROWN if v.race == Agent.DWARF else PURPLE))
-                pygame.draw.rect(screen, village_color,
-                                 (v.x * CELL_SIZE - size, v.y * CELL_SIZE - size, CELL_SIZE + 2 * size,
-                                  CELL_SIZE + 2 * size), 2)
-            for a in agents:
-                pygame.draw.rect(screen, a.color, (a.x * CELL_SIZE, a.y * CELL_SIZE, CELL_SIZE, CELL_SIZE))
-
-            y_offset = 10
-            race_counts = {race: sum(1 for a in agents if a.race == race) for race in
-                           [Agent.HUMAN, Agent.ELF, Agent.DWARF, Agent.ORC]}
-            race_colors = {Agent.HUMAN: RED, Agent.ELF: GREEN, Agent.DWARF: BROWN, Agent.ORC: PURPLE}
-
-            for race, count in race_counts.items():
-                pygame.draw.rect(screen, race_colors[race], (10, y_offset + 3, 15, 15))
-                text = font.render(f"{race}: {count}", True, WHITE)
-                screen.blit(text, (30, y_offset))
+                    terrain_rects = terrain_view.refresh(camera)
+                    terrain_view.draw(screen, camera)
+                    for f in world.food:
+                        if x0 <= f.x < x1 and y0 <= f.y < y1:
+                            drawn.append(pygame.draw.rect(screen, YELLOW, camera.cell_rect(f.x, f.y)))
+                for v in world.villages.near((x0 + x1) // 2, (y0 + y1) // 2, max(x1 - x0, y1 - y0) // 2 + 1):
+                    size = v.level * camera.zoom // 5
+                    village_color = ORANGE if v.race == Agent.HUMAN else (
+                        GREEN if v.race == Agent.ELF else (BROWN if v.race == Agent.DWARF else PURPLE))
+                    drawn.append(pygame.draw.rect(screen, village_color, camera.cell_rect(v.x, v.y).inflate(2 * size, 2 * size), 2))
+                for hazard in world.hazards:
+                    if hazard.kind == Hazard.FIRE:
+                        for x, y in zip(hazard.xs.tolist(), hazard.ys.tolist()):
+                            if x0 <= x < x1 and y0 <= y < y1:
+                                drawn.append(pygame.draw.rect(screen, ORANGE, camera.cell_rect(x, y)))
+                if not cell_view:
+                    for a in world.agents:
+                        if x0 <= a.x < x1 and y0 <= a.y < y1:
+                            drawn.append(pygame.draw.rect(screen, a.color, camera.cell_rect(a.x, a.y)))
+
+                profiler.stop("render.world")
+
+                profiler.start("render.hud")
+                y_offset = 10
+                race_counts = world.race_counts()
+                race_colors = {Agent.HUMAN: RED, Agent.ELF: GREEN, Agent.DWARF: BROWN, Agent.ORC: PURPLE}
+
+                for race, count in race_counts.items():
+                    drawn.append(pygame.draw.rect(screen, race_colors[race], (10, y_offset + 3, 15, 15)))
+                    text = font.render(f"{race}: {count}", True, WHITE)
+                    drawn.append(screen.blit(text, (30, y_offset)))
+                    y_offset += 25
+
+                text = font.render(f"Celkem: {len(world.agents)}", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 25
+                text = font.render(f"Vesnice: {len(world.villages)}", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 25
+                text = font.render(f"Jídlo: {len(world.food)}", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
                 y_offset += 25
+                text = font.render(f"Katastrofy: {len(world.hazards)}  Nakažení: {world.plague_cases()}", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 30
+                text = font.render("Nástroje: 1-Human 2-Elf 3-Dwarf 4-Orc", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 20
+                text = font.render("M-Meteor L-Blesk B-Požár N-Mor V-Povodeň F-Jídlo", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 20
+                text = font.render(f"G-Hledání jídla ({'zap' if settings.foraging else 'vyp'})"
+                                   f"  WASD/pravé tlačítko-Posun kolečko-Zoom", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 20
+                text = font.render("SPACE-Pauza TAB-Menu P-Profil O-Uložit profil F5-Uložit svět", True, YELLOW)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 20
+                text = font.render("F1-1× F2-10× F3-100× F4-Max R-Vykreslovat každý k-tý snímek", True, YELLOW)
+                drawn.append(screen.blit(text, (10, y_offset)))
+                y_offset += 20
+                text = font.render(f"Tick: {world.tick}  Rychlost: {f'{speed}×' if speed else 'Max'}"
+                                   f"  {tick_rate:.0f} ticků/s  Snímek: 1/{render_every}", True, WHITE)
+                drawn.append(screen.blit(text, (10, y_offset)))
 
-            text = font.render(f"Celkem: {len(agents)}", True, WHITE)
-            screen.blit(text, (10, y_offset))
-            y_offset += 25
-            text = font.render(f"Vesnice: {len(villages)}", True, WHITE)
-            screen.blit(text, (10, y_offset))
-            y_offset += 25
-            text = font.render(f"Jídlo: {len(food)}", True, WHITE)
-            screen.blit(text, (10, y_offset))
-            y_offset += 30
-            text = font.render("Nástroje: 1-Human 2-Elf 3-Dwarf 4-Orc", True, WHITE)
-            screen.blit(text, (10, y_offset))
-            y_offset += 20
-            text = font.render("M-Meteor L-Blesk F-Jídlo", True, WHITE)
-            screen.blit(text, (10, y_offset))
-            y_offset += 20
-            text = font.render("SPACE-Pauza TAB-Menu", True, YELLOW)
-            screen.blit(text, (10, y_offset))
-
-            if selected_tool:
-                text = font.render(f"Vybrán: {selected_tool}", True, YELLOW)
-                screen.blit(text, (WIDTH - 250, 10))
-            if paused:
-                text = font.render("PAUZA", True, RED)
-                screen.blit(text, (WIDTH // 2 - 40, HEIGHT // 2))
-        else:
-            title = font.render("=== NASTAVENÍ PARAMETRŮ (TAB pro zavření) ===", True, YELLOW)
-            screen.blit(title, (WIDTH // 2 - 250, 30))
-            for slider in sliders:
-                slider.draw(screen, font)
+                if show_profile:
+                    profile_y = 40
+                    for name, stats in sorted(profiler.stats().items()):
+                        text = font.render(f"{name}: {stats['mean_ms']:.2f} ms (p95 {stats['p95_ms']:.2f})", True, WHITE)
+                        drawn.append(screen.blit(text, (WIDTH - 420, profile_y)))
+                        profile_y += 20
+
+                if replay:
+                    text = font.render(f"Záznam: tick {world.tick}/{replay.last_tick} ×{replay_speed * replay_direction}"
+                                       f" (←/→ směr, ↑/↓ rychlost, HOME začátek)", True, YELLOW)
+                    drawn.append(screen.blit(text, (WIDTH // 2 - 250, HEIGHT - 30)))
+                if selected_tool:
+                    text = font.render(f"Vybrán: {selected_tool}", True, YELLOW)
+                    drawn.append(screen.blit(text, (WIDTH - 250, 10)))
+                if paused:
+                    text = font.render("PAUZA", True, RED)
+                    drawn.append(screen.blit(text, (WIDTH // 2 - 40, HEIGHT // 2)))
+                profiler.stop("render.hud")
+            elif show_menu:
+                terrain_rects = []
+                screen.fill(BLACK)
+                title = font.render("=== NASTAVENÍ PARAMETRŮ (TAB pro zavření) ===", True, YELLOW)
+                screen.blit(title, (WIDTH // 2 - 250, 30))
+                for slider in sliders:
+                    slider.draw(screen, font)
 
-        pygame.display.flip()
-        clock.tick(FPS)
+            if render_frame:
+                profiler.start("render.present")
+                if show_menu or full_redraw or len(previous_rects) + len(drawn) > MAX_DIRTY_RECTS:
+                    pygame.display.flip()
+                else:
+                    pygame.display.update(previous_rects + drawn + terrain_rects)
+                profiler.stop("render.present")
+                previous_rects = drawn
+                full_redraw = False
+            profiler.stop("render")
+            profiler.stop("frame")
+            frame_seconds = clock.tick(FPS if speed else 0) / 1000
 
+        if event_log:
+            event_log.close()
+        if telemetry:
+            telemetry.close()
+    finally:
+        world.close()
     pygame.quit()
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="WorldBox simulátor")
+    parser.add_argument("--headless", action="store_true", help="běh bez okna a vykreslování")
+    parser.add_argument("--ticks", type=int, default=1000, help="počet ticků v headless režimu")
+    parser.add_argument("--seed", type=int, default=None, help="seed pro reprodukovatelný běh")
+    parser.add_argument("--arrays", action="store_true", help="agenti v NumPy polích (vektorizovaný tick)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="počet procesů pro paralelní tick po dlaždicích (sdílená paměť, 0 = vypnuto)")
+    parser.add_argument("--rects", action="store_true", help="vykreslování po jednotlivých obdélnících")
+    parser.add_argument("--profile", metavar="SOUBOR", default=None,
+                        help="měřit fáze ticku (headless: zapsat do souboru na konci, okno: cíl klávesy O)")
+    parser.add_argument("--report-every", type=int, default=0, help="průběžný výpis každých N ticků")
+    parser.add_argument("--load", metavar="SOUBOR", default=None, help="načíst svět ze snapshotu")
+    parser.add_argument("--checkpoint", metavar="SOUBOR", default="worldbox.snap", help="cíl snapshotů (F5)")
+    parser.add_argument("--checkpoint-every", type=int, default=0, help="automatický snapshot každých N ticků")
+    parser.add_argument("--record", metavar="SOUBOR", default=None, help="zapisovat záznam událostí")
+    parser.add_argument("--keyframe-every", type=int, default=1000, help="keyframe záznamu každých N ticků")
+    parser.add_argument("--replay", metavar="SOUBOR", default=None, help="přehrát záznam událostí")
+    parser.add_argument("--seek", type=int, default=0, help="tick, na který se má záznam přetočit")
+    parser.add_argument("--width", type=int, default=GRID_WIDTH, help="šířka světa v buňkách")
+    parser.add_argument("--height", type=int, default=GRID_HEIGHT, help="výška světa v buňkách")
+    parser.add_argument("--speed", choices=["1", "10", "100", "max"], default="1", help="počáteční rychlost simulace")
+    parser.add_argument("--render-every", type=int, default=1, help="vykreslovat jen každý k-tý snímek")
+    parser.add_argument("--stats", metavar="SOUBOR", default=None,
+                        help="průběžně zapisovat statistiky do CSV (nebo JSONL podle přípony .jsonl)")
+    parser.add_argument("--stats-every", type=int, default=100, help="řádek statistik každých N ticků")
+    parser.add_argument("--forage", action="store_true",
+                        help="agenti míří k nejbližšímu jídlu podle pole vzdáleností místo náhodné chůze")
+    parser.add_argument("--inactive-every", type=int, default=1,
+                        help="chunky bez agentů simulovat jen každý N-tý tick (0 = vůbec)")
+    return parser.parse_args(argv)
+
+
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    settings.inactive_chunk_interval = args.inactive_every
+    settings.foraging = args.forage
+    checkpointer = Checkpointer(args.checkpoint, args.checkpoint_every)
+    event_log = EventLog(args.record, args.keyframe_every) if args.record else None
+    telemetry = Telemetry(args.stats, max(1, args.stats_every)) if args.stats else None
+    if args.headless and args.replay:
+        replay_headless(args.replay, args.seek)
+    elif args.headless:
+        run_headless(args.ticks, args.seed, args.report_every, args.arrays, args.profile, args.load, checkpointer,
+                     event_log, args.width, args.height, telemetry, args.workers)
+    else:
+        replay = Replay(args.replay) if args.replay else None
+        if replay:
+            replay.seek(args.seek)
+        main(args.seed, args.arrays, args.rects, args.profile, args.load, checkpointer, event_log, replay,
+             args.width, args.height, None if args.speed == "max" else int(args.speed), max(1, args.render_every),
+             telemetry, args.workers)
@@ -0,0 +1,155 @@
+import argparse
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from WorldBox import GRID_HEIGHT, GRID_WIDTH, Agent, ArrayWorld, FoodStore, ParallelWorld, World, np, settings
+
+ENGINES = {"objects": World, "arrays": ArrayWorld, "parallel": ParallelWorld}
+
+
+def random_walkable(world, rng):
+    while True:
+        x, y = rng.randrange(world.width), rng.randrange(world.height)
+        if world.terrain.is_walkable(x, y):
+            return x, y
+
+
+def build_world(engine, agents, food, seed, width=GRID_WIDTH, height=GRID_HEIGHT, workers=None):
+    if engine == "parallel":
+        world = ParallelWorld(seed, width=width, height=height, workers=workers)
+    else:
+        world = ENGINES[engine](seed, width=width, height=height)
+    world.setup_agents()
+    world.food = FoodStore()
+    rng = random.Random(seed)
+    spots = [random_walkable(world, rng) for _ in range(agents)]
+    races = [rng.randrange(len(Agent.RACES)) for _ in range(agents)]
+    if isinstance(world, ArrayWorld):
+        world.add_agents(np.array([x for x, _ in spots]), np.array([y for _, y in spots]), np.array(races))
+    else:
+        for (x, y), race in zip(spots, races):
+            world.add_agent(x, y, Agent.RACES[race])
+    for _ in range(food):
+        world.food.add(*random_walkable(world, rng))
+    return world
+
+
+def run_ticks(world, ticks):
+    phases = {phase: 0.0 for phase in world.PHASES}
+    start = time.perf_counter()
+    for _ in range(ticks):
+        for phase in world.PHASES:
+            phase_start = time.perf_counter()
+            getattr(world, phase)()
+            phases[phase] += time.perf_counter() - phase_start
+        world.tick += 1
+    return time.perf_counter() - start, phases
+
+
+def measure_peak_memory(engine, agents, food, seed, ticks, width, height, workers=None):
+    tracemalloc.start()
+    try:
+        world = build_world(engine, agents, food, seed, width, height, workers)
+        try:
+            world.step(ticks)
+        finally:
+            world.close()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_case(engine, agents, food, ticks, seed, memory_ticks, width=GRID_WIDTH, height=GRID_HEIGHT,
+                   workers=None):
+    peak_memory = measure_peak_memory(engine, agents, food, seed, min(ticks, memory_ticks), width, height, workers)
+    world = build_world(engine, agents, food, seed, width, height, workers)
+    try:
+        elapsed, phases = run_ticks(world, ticks)
+    finally:
+        world.close()
+    return {
+        "engine": engine,
+        "workers": world.workers if engine == "parallel" else 1,
+        "forage": settings.foraging,
+        "width": width,
+        "height": height,
+        "agents": agents,
+        "food": food,
+        "ticks": ticks,
+        "seconds": elapsed,
+        "ticks_per_sec": ticks / elapsed if elapsed else None,
+        "phases": {phase: {"total_s": total, "mean_ms": total / ticks * 1000 if ticks else 0.0}
+                   for phase, total in phases.items()},
+        "final_agents": len(world.agents),
+        "final_food": len(world.food),
+        "final_villages": len(world.villages),
+        "peak_memory_bytes": peak_memory,
+    }
+
+
+def parse_map(value):
+    width, _, height = value.lower().partition("x")
+    try:
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"očekáváno ŠÍŘKAxVÝŠKA, ne {value!r}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark propustnosti ticku WorldBoxu")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="počty agentů")
+    parser.add_argument("--food", type=int, nargs="+", default=None,
+                        help="počty jídla (jedno číslo pro všechny velikosti, jinak jedno na velikost)")
+    parser.add_argument("--engines", nargs="+", choices=sorted(ENGINES), default=["objects"])
+    parser.add_argument("--maps", type=parse_map, nargs="+", default=[(GRID_WIDTH, GRID_HEIGHT)],
+                        help="rozměry světa ŠÍŘKAxVÝŠKA")
+    parser.add_argument("--workers", type=int, nargs="+", default=[None],
+                        help="počty procesů pro engine 'parallel' (výchozí počet jader)")
+    parser.add_argument("--forage", action="store_true", help="pohyb k jídlu podle pole vzdáleností")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--memory-ticks", type=int, default=10, help="ticků pro měření špičky paměti")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="soubor pro JSON výsledky (výchozí stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    settings.foraging = args.forage
+    if {"arrays", "parallel"} & set(args.engines) and np is None:
+        sys.exit("Enginy 'arrays' a 'parallel' vyžadují numpy")
+    food_sizes = args.food or [size // 2 for size in args.sizes]
+    if len(food_sizes) == 1:
+        food_sizes = food_sizes * len(args.sizes)
+    if len(food_sizes) != len(args.sizes):
+        sys.exit("--food musí mít jednu hodnotu nebo jednu na každou velikost")
+    results = []
+    for engine in args.engines:
+        for workers in args.workers if engine == "parallel" else [None]:
+            for width, height in args.maps:
+                for agents, food in zip(args.sizes, food_sizes):
+                    results.append(benchmark_case(engine, agents, food, args.ticks, args.seed, args.memory_ticks,
+                                                  width, height, workers))
+                    print(f"{engine}×{results[-1]['workers']} {width}x{height} {agents} agentů: "
+                          f"{results[-1]['ticks_per_sec']:.1f} ticků/s", file=sys.stderr)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "ticks": args.ticks,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
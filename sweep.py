@@ -0,0 +1,153 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import WorldBox
+from WorldBox import Agent, ArrayWorld, GameSettings, World
+
+
+def parse_param(spec):
+    name, _, values = spec.partition("=")
+    if not values or not hasattr(GameSettings(), name):
+        raise argparse.ArgumentTypeError(f"neplatný parametr '{spec}', očekáváno jméno=hodnoty")
+    if ":" in values:
+        low, high = values.split(":")
+        return name, (float(low), float(high))
+    return name, [float(value) for value in values.split(",")]
+
+
+def cast_value(name, value):
+    default = getattr(GameSettings(), name)
+    return int(round(value)) if isinstance(default, int) else float(value)
+
+
+def build_jobs(params, seeds, samples, sample_seed):
+    names = [name for name, _ in params]
+    if samples:
+        rng = random.Random(sample_seed)
+        combos = []
+        for _ in range(samples):
+            combo = []
+            for _, values in params:
+                combo.append(rng.uniform(*values) if isinstance(values, tuple) else rng.choice(values))
+            combos.append(combo)
+    else:
+        if any(isinstance(values, tuple) for _, values in params):
+            raise SystemExit("rozsahy low:high vyžadují --samples")
+        combos = itertools.product(*(values for _, values in params))
+    jobs = []
+    for combo in combos:
+        overrides = {name: cast_value(name, value) for name, value in zip(names, combo)}
+        for seed in seeds:
+            jobs.append({"run_id": len(jobs), "seed": seed, "settings": overrides})
+    return jobs
+
+
+def apply_settings(overrides):
+    WorldBox.settings.__dict__.update(vars(GameSettings()))
+    for name, value in overrides.items():
+        setattr(WorldBox.settings, name, value)
+
+
+def run_job(job, ticks, sample_every, array_mode, time_limit):
+    apply_settings(job["settings"])
+    start = time.perf_counter()
+    world = ArrayWorld(job["seed"]) if array_mode else World(job["seed"])
+    series = {"tick": [], "villages": [], "food": []}
+    series.update({race: [] for race in Agent.RACES})
+    race_extinction = {}
+    extinction_tick = None
+    status = "ok"
+    while world.tick < ticks:
+        world.step()
+        counts = world.race_counts()
+        for race, count in counts.items():
+            if count == 0 and race not in race_extinction:
+                race_extinction[race] = world.tick
+        if world.tick % sample_every == 0 or not len(world.agents):
+            series["tick"].append(world.tick)
+            series["villages"].append(len(world.villages))
+            series["food"].append(len(world.food))
+            for race, count in counts.items():
+                series[race].append(count)
+        if not len(world.agents):
+            extinction_tick = world.tick
+            break
+        if time_limit and time.perf_counter() - start > time_limit:
+            status = "timeout"
+            break
+    return dict(job, status=status, ticks_run=world.tick, extinction_tick=extinction_tick,
+                race_extinction=race_extinction, final=dict(world.race_counts(), villages=len(world.villages),
+                                                            food=len(world.food)),
+                elapsed=time.perf_counter() - start, series=series)
+
+
+def completed_runs(path):
+    done = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("status") in ("ok", "timeout"):
+                    done.add(run_key(record))
+    return done
+
+
+def run_key(job):
+    return job["seed"], json.dumps(job["settings"], sort_keys=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Paralelní průchod parametry GameSettings")
+    parser.add_argument("params", nargs="+", type=parse_param,
+                        help="jméno=v1,v2,... (mřížka) nebo jméno=min:max (náhodný vzorek)")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument("--samples", type=int, default=0, help="počet náhodných kombinací místo celé mřížky")
+    parser.add_argument("--sample-seed", type=int, default=0)
+    parser.add_argument("--ticks", type=int, default=5000)
+    parser.add_argument("--sample-every", type=int, default=100, help="interval záznamu časové řady")
+    parser.add_argument("--arrays", action="store_true", help="použít ArrayWorld")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--time-limit", type=float, default=0, help="limit sekund na jeden běh (0 = bez limitu)")
+    parser.add_argument("--output", default="sweep_results.jsonl")
+    parser.add_argument("--resume", action="store_true", help="přeskočit běhy, které už ve výstupu jsou")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = build_jobs(args.params, args.seeds, args.samples, args.sample_seed)
+    if args.resume:
+        done = completed_runs(args.output)
+        jobs = [job for job in jobs if run_key(job) not in done]
+    print(f"Běhů: {len(jobs)}, workerů: {args.workers}", file=sys.stderr)
+    with open(args.output, "a" if args.resume else "w", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(run_job, job, args.ticks, args.sample_every, args.arrays, args.time_limit): job
+                   for job in jobs}
+        for finished, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            try:
+                record = future.result()
+            except BrokenProcessPool as exc:
+                record = dict(job, status="crashed", error=str(exc))
+            except Exception as exc:
+                record = dict(job, status="error", error=f"{type(exc).__name__}: {exc}")
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            print(f"[{finished}/{len(jobs)}] běh {job['run_id']}: {record['status']}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()